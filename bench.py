@@ -0,0 +1,302 @@
+#!/usr/bin/python
+
+"""
+Benchmarks for the simulator.
+
+  python bench.py pieces [--num-pieces 10,100,1000] [options] PeerClass1[,count] ...
+
+times complete simulations for each file size and reports the average wall
+time per round, to show how round time scales with the number of pieces.
+
+  python bench.py messages [options] PeerClass1[,count] ...
+
+counts the Upload, Request, Download and PeerInfo objects one simulation
+allocates, and compares their size and construction time with equivalent
+__dict__-backed classes.
+
+  python bench.py suite [--presets small,medium] [--agents ...] [--output FILE]
+
+runs every shipped agent on each swarm preset with a fixed seed, times
+each phase of the round loop, and writes the results as JSON.
+
+  python bench.py compare OLD.json NEW.json
+
+prints the per-round time of each case in two suite results side by side.
+"""
+
+import sys
+import time
+import json
+import logging
+import platform
+import subprocess
+from optparse import OptionParser
+
+import messages
+from sim import Sim, parse_agents, default_config
+from timing import PhaseTimer, PHASES
+
+# name -> (peers, num_pieces, blocks_per_piece, max_round)
+PRESETS = {
+    "small": (10, 20, 4, 200),
+    "medium": (50, 100, 8, 500),
+    "huge": (200, 400, 16, 1000),
+}
+
+SUITE_AGENTS = ["Dummy", "Seed", "KrankileStd", "KrankileTyrant",
+                "KrankilePropshare", "KrankileTourney"]
+
+MESSAGE_CLASSES = [messages.Upload, messages.Request, messages.Download,
+                   messages.PeerInfo]
+
+
+def make_config(agents, num_pieces, blocks_per_piece, max_round,
+                min_up_bw=4, max_up_bw=10):
+    config = default_config(agents)
+    config.add("num_pieces", num_pieces)
+    config.add("blocks_per_piece", blocks_per_piece)
+    config.add("max_round", max_round)
+    config.add("min_up_bw", min_up_bw)
+    config.add("max_up_bw", max_up_bw)
+    config.add("quiet", True)
+    config.add("seed", 0)
+    return config
+
+
+def time_rounds(config, seed):
+    """Run one simulation.  Returns (rounds played, seconds per round)."""
+    sim = Sim(config)
+    start = time.time()
+    history = sim.run_sim_once(seed)
+    elapsed = time.time() - start
+    rounds = history.last_round() + 1
+    return (rounds, elapsed / rounds)
+
+
+def piece_scaling(agents, piece_counts, blocks_per_piece, max_round, seed):
+    """Returns a list of (num_pieces, rounds, seconds per round)."""
+    results = []
+    for num_pieces in piece_counts:
+        config = make_config(agents, num_pieces, blocks_per_piece, max_round)
+        (rounds, per_round) = time_rounds(config, seed)
+        results.append((num_pieces, rounds, per_round))
+    return results
+
+
+def count_messages(config, seed):
+    """
+    Run one simulation, counting the instances of each message class
+    constructed.  Returns dict : class -> count.
+    """
+    counts = dict((cls, 0) for cls in MESSAGE_CLASSES)
+    originals = dict((cls, cls.__dict__["__init__"]) for cls in MESSAGE_CLASSES)
+
+    def counting(cls, init):
+        def __init__(self, *args):
+            counts[cls] += 1
+            init(self, *args)
+        return __init__
+
+    try:
+        for cls in MESSAGE_CLASSES:
+            cls.__init__ = counting(cls, originals[cls])
+        sim = Sim(config)
+        sim.run_sim_once(seed)
+    finally:
+        for cls in MESSAGE_CLASSES:
+            cls.__init__ = originals[cls]
+    return counts
+
+
+def dict_backed(cls):
+    """The same class, but with a per-instance __dict__ instead of slots."""
+    return type(cls.__name__, (object,), {"__init__": cls.__dict__["__init__"]})
+
+
+def instance_cost(cls, n=100000):
+    """Returns (bytes per instance, seconds per construction) for cls."""
+    args = {
+        "Upload": ("Seed0", "Dummy0", 4),
+        "Request": ("Dummy0", "Seed0", 3, 0),
+        "Download": ("Seed0", "Dummy0", 3, 4),
+        "PeerInfo": ("Seed0", None),
+    }[cls.__name__]
+    start = time.time()
+    for i in xrange(n):
+        obj = cls(*args)
+    elapsed = time.time() - start
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return (size, elapsed / n)
+
+
+def message_costs(agents, num_pieces, blocks_per_piece, max_round, seed):
+    """
+    Returns a list of (class name, instances, slotted bytes, dict bytes,
+    slotted seconds, dict seconds), the totals for one simulation.
+    """
+    config = make_config(agents, num_pieces, blocks_per_piece, max_round)
+    counts = count_messages(config, seed)
+    results = []
+    for cls in MESSAGE_CLASSES:
+        (slot_size, slot_time) = instance_cost(cls)
+        (dict_size, dict_time) = instance_cost(dict_backed(cls))
+        n = counts[cls]
+        results.append((cls.__name__, n, n * slot_size, n * dict_size,
+                        n * slot_time, n * dict_time))
+    return results
+
+
+def suite_population(agent, peers):
+    """
+    The peers for one suite case: a tenth seeds, the rest running agent.
+    Seed is timed uploading to Dummy downloaders, half and half.
+    """
+    if agent == "Seed":
+        seeds = peers // 2
+        return ["Seed"] * seeds + ["Dummy"] * (peers - seeds)
+    seeds = max(1, peers // 10)
+    return ["Seed"] * seeds + [agent] * (peers - seeds)
+
+
+def time_phases(preset, agent, seed):
+    """Run one suite case.  Returns a dict of results for the JSON output."""
+    (peers, num_pieces, blocks_per_piece, max_round) = PRESETS[preset]
+    config = make_config(suite_population(agent, peers), num_pieces,
+                         blocks_per_piece, max_round)
+    timer = PhaseTimer()
+    sim = Sim(config, timer)
+    start = time.time()
+    sim.run_sim_once(seed)
+    elapsed = time.time() - start
+    rounds = max(timer.rounds, 1)
+    return {
+        "preset": preset,
+        "agent": agent,
+        "peers": peers,
+        "num_pieces": num_pieces,
+        "blocks_per_piece": blocks_per_piece,
+        "seed": seed,
+        "rounds": timer.rounds,
+        "total_s": elapsed,
+        "ms_per_round": elapsed * 1000 / rounds,
+        "phases_ms_per_round": dict((phase, timer.totals[phase] * 1000 / rounds)
+                                    for phase in PHASES),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"]).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(presets, agents, seed):
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "results": [time_phases(preset, agent, seed)
+                    for preset in presets for agent in agents],
+    }
+
+
+def compare(old, new):
+    """Print ms/round for each case found in both suite results."""
+    key = lambda r: (r["preset"], r["agent"])
+    before = dict((key(r), r) for r in old["results"])
+    print "%-8s %-18s %12s %12s %8s" % ("preset", "agent", "old ms", "new ms", "ratio")
+    for r in new["results"]:
+        if key(r) not in before:
+            continue
+        a = before[key(r)]["ms_per_round"]
+        b = r["ms_per_round"]
+        print "%-8s %-18s %12.2f %12.2f %8.2f" % (
+            r["preset"], r["agent"], a, b, b / a if a else float("nan"))
+
+
+def main(args):
+    usage_msg = "Usage:  %prog pieces|messages|suite|compare [options] [args]"
+    parser = OptionParser(usage=usage_msg)
+
+    parser.add_option("--num-pieces",
+                      dest="num_pieces", default="10,100,1000",
+                      help="Comma separated list of file sizes (only the "
+                      "first is used by 'messages')")
+
+    parser.add_option("--blocks-per-piece",
+                      dest="blocks_per_piece", default=4, type="int",
+                      help="Set number of blocks per piece")
+
+    parser.add_option("--max-round",
+                      dest="max_round", default=20, type="int",
+                      help="Limit on number of rounds")
+
+    parser.add_option("--seed",
+                      dest="seed", default=0, type="int",
+                      help="Random seed for every timed run")
+
+    parser.add_option("--presets",
+                      dest="presets", default="small,medium",
+                      help="Comma separated swarm presets for 'suite': %s" %
+                      ", ".join(sorted(PRESETS)))
+
+    parser.add_option("--agents",
+                      dest="agents", default=",".join(SUITE_AGENTS),
+                      help="Comma separated agent classes for 'suite'")
+
+    parser.add_option("--output",
+                      dest="output", default="-",
+                      help="File to write 'suite' JSON results to (default: stdout)")
+
+    (options, args) = parser.parse_args(args[1:])
+
+    if len(args) == 0 or args[0] not in ("pieces", "messages", "suite", "compare"):
+        parser.print_help()
+        sys.exit(1)
+
+    if args[0] == "compare":
+        if len(args) != 3:
+            parser.print_help()
+            sys.exit(1)
+        compare(json.load(open(args[1])), json.load(open(args[2])))
+        return
+
+    agents = parse_agents(args[1:]) or ['Seed', 'Seed'] + ['KrankileStd'] * 10
+    logging.getLogger('').setLevel(logging.WARNING)
+
+    if args[0] == "suite":
+        # Agents may print (Dummy does), so keep stdout for the JSON
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            results = run_suite(options.presets.split(','),
+                                options.agents.split(','), options.seed)
+        finally:
+            sys.stdout = stdout
+        out = sys.stdout if options.output == "-" else open(options.output, "w")
+        json.dump(results, out, indent=2, sort_keys=True)
+        out.write("\n")
+        return
+
+    piece_counts = [int(n) for n in options.num_pieces.split(',')]
+    if args[0] == "pieces":
+        print "%10s %8s %14s" % ("num_pieces", "rounds", "ms/round")
+        for (num_pieces, rounds, per_round) in piece_scaling(
+                agents, piece_counts, options.blocks_per_piece,
+                options.max_round, options.seed):
+            print "%10d %8d %14.2f" % (num_pieces, rounds, per_round * 1000)
+    else:
+        print "%-10s %10s %12s %12s %10s %10s" % (
+            "class", "instances", "slots KB", "dict KB", "slots ms", "dict ms")
+        for (name, n, slot_size, dict_size, slot_time, dict_time) in message_costs(
+                agents, piece_counts[0], options.blocks_per_piece,
+                options.max_round, options.seed):
+            print "%-10s %10d %12.1f %12.1f %10.1f %10.1f" % (
+                name, n, slot_size / 1024.0, dict_size / 1024.0,
+                slot_time * 1000, dict_time * 1000)
+
+
+if __name__ == "__main__":
+    main(sys.argv)
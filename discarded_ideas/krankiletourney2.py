@@ -1,6 +1,5 @@
 #!/usr/bin/python
 
-import random
 import logging
 import math
 from collections import defaultdict, Counter
@@ -43,9 +42,9 @@ class KrankileTourney2(KrankileTyrant):
             
             lisect = list(isect)
 
-            lisect = sorted(lisect, lambda p1, p2: piece_counter[p1] - piece_counter[p2], reverse=random.random() < 0.30)
+            lisect = sorted(lisect, lambda p1, p2: piece_counter[p1] - piece_counter[p2], reverse=self.rng.random() < 0.30)
             pieces = lisect[:n+5] if len(lisect) else []
-            random.shuffle(pieces)
+            self.rng.shuffle(pieces)
             for piece_id in pieces[:n]:
                 start_block = self.pieces[piece_id]
                 r = Request(self.id, peer.id, piece_id, start_block)
@@ -1,6 +1,5 @@
 #!/usr/bin/python
 
-import random
 import logging
 import math
 from collections import defaultdict, Counter
@@ -46,7 +45,7 @@ class KrankileTourney3(KrankileTyrant):
 
             lisect = sorted(lisect, lambda p1, p2: piece_counter[p1] - piece_counter[p2])
             rarest = [lisect.pop(0)] if len(lisect) else []
-            random.shuffle(lisect)
+            self.rng.shuffle(lisect)
 
             pieces = rarest + lisect[:n-1]
 
@@ -1,9 +1,8 @@
 #!/usr/bin/python
 
-import random
 import logging
 import math
-from collections import defaultdict, Counter
+from collections import defaultdict
 from operator import itemgetter
 
 from messages import Upload, Request
@@ -28,13 +27,6 @@ class KrankileTourney4(KrankileTyrant):
         # We'll put all the things we want here
         requests = []
 
-        # Create a datastructure for tallying up what pieces are the most rare
-        piece_counter = Counter()
-        for peer in peers: 
-            av = set(peer.available_pieces)
-            av_needed = av.intersection(np_set)
-            piece_counter.update(av_needed)
-        
         # Go through each peer and ask for the most rare pieces they have and we want
         for peer in peers:
             available_piece_set = set(peer.available_pieces)
@@ -42,11 +34,9 @@ class KrankileTourney4(KrankileTyrant):
 
             n = min(self.max_requests, len(isect))
             
-            lisect = list(isect)
-
-            lisect = sorted(lisect, lambda p1, p2: piece_counter[p1] - piece_counter[p2])
-            rarest = [lisect.pop(0)] if len(lisect) else []
-            random.shuffle(lisect)
+            rarest = self.rarity.rarest(isect, 1)
+            lisect = list(isect.difference(rarest))
+            self.rng.shuffle(lisect)
 
             pieces = rarest + lisect[:n-1]
 
@@ -73,7 +63,7 @@ class KrankileTourney4(KrankileTyrant):
 
         n = min(len(requests), 3)
 
-        chosen_requests = random.sample(requests, n)
+        chosen_requests = self.rng.sample(requests, n)
         chosen = [request.requester_id for request in chosen_requests]
         # Evenly "split" my upload bandwidth among the one chosen requester
         bws = even_split(self.up_bw, len(chosen))
@@ -6,7 +6,6 @@
 # You'll want to copy this file to AgentNameXXX.py for various versions of XXX,
 # probably get rid of the silly logging messages, and then add more logic.
 
-import random
 import logging
 
 from messages import Upload, Request
@@ -47,11 +46,11 @@ class Dummy(Peer):
         requests = []   # We'll put all the things we want here
 
         # Symmetry breaking is good...
-        random.shuffle(needed_pieces)
+        self.rng.shuffle(needed_pieces)
         
         # Sort peers by id.  This is probably not a useful sort, but other 
         # sorts might be useful
-        peers.sort(key=lambda p: p.id)
+        peers = sorted(peers, key=lambda p: p.id)
         # request all available pieces from all peers!
         # (up to self.max_requests from each)
         for peer in peers:
@@ -61,7 +60,7 @@ class Dummy(Peer):
             # More symmetry breaking -- ask for random pieces.
             # This would be the place to try fancier piece-requesting strategies
             # to avoid getting the same thing from multiple peers at a time.
-            for piece_id in random.sample(isect, n):
+            for piece_id in self.rng.sample(isect, n):
                 # aha! The peer has this piece! Request it.
                 # which part of the piece do we need next?
                 # (must get the next-needed blocks in order)
@@ -100,7 +99,7 @@ class Dummy(Peer):
         # change my internal state for no reason
         self.dummy_state["cake"] = "pie"
 
-        request = random.choice(requests)
+        request = self.rng.choice(requests)
         chosen = [request.requester_id]
         # Evenly "split" my upload bandwidth among the one chosen requester
         bws = even_split(self.up_bw, len(chosen))
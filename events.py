@@ -0,0 +1,190 @@
+#!/usr/bin/python
+
+"""
+Columnar storage for the events History records, and a compact binary
+file format for them.
+
+Each EventTable keeps one typed array per column (e.g. round, from_idx,
+to_idx, piece, blocks), with peer ids interned to their index in the sim's
+peer list.  Block counts and bandwidths are stored as doubles, with a flag
+column recording whether each one was an int, so they come back as the
+type the sim recorded.  Rows are appended a round at a time, grouped by the peer that
+owns them (the downloader for downloads, the uploader for uploads), and
+`starts` records where each (round, peer) group begins, so one peer's
+events for one round are a contiguous slice.
+
+save() writes the tables to a file that load() maps back in without
+parsing.  With numpy installed the columns come back as arrays viewing the
+memory-mapped file; otherwise they are read into array.arrays.  Files use
+the machine's native byte order.
+"""
+
+import mmap
+import struct
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b"BTEV"
+VERSION = 2
+
+DOWNLOAD_COLUMNS = [("round", "i"), ("from_idx", "i"), ("to_idx", "i"),
+                    ("piece", "i"), ("blocks", "d"), ("blocks_int", "b")]
+UPLOAD_COLUMNS = [("round", "i"), ("from_idx", "i"), ("to_idx", "i"),
+                  ("bw", "d"), ("bw_int", "b")]
+
+
+class EventTable:
+    def __init__(self, num_peers, columns):
+        """columns: [(name, array typecode)]"""
+        self.num_peers = num_peers
+        self.names = [name for (name, code) in columns]
+        self.columns = [array(code) for (name, code) in columns]
+        # Absolute row where each (round, peer) group starts, plus one
+        # entry for the end of the last group.
+        self.starts = array('l', [0])
+        self.first_round = 0  # oldest round still stored
+        self.dropped = 0      # rows dropped from the front so far
+
+    def rounds(self):
+        """Number of rounds stored."""
+        return (len(self.starts) - 1) // self.num_peers
+
+    def append_round(self, groups):
+        """groups: one list of row tuples per peer, in peer order."""
+        columns = self.columns
+        for rows in groups:
+            for row in rows:
+                for (column, value) in zip(columns, row):
+                    column.append(value)
+            self.starts.append(self.dropped + len(columns[0]))
+
+    def rows(self, round, peer_idx):
+        """Indices into the columns of peer_idx's events in round."""
+        g = (round - self.first_round) * self.num_peers + peer_idx
+        return range(self.starts[g] - self.dropped,
+                     self.starts[g + 1] - self.dropped)
+
+    def drop_rounds(self, k):
+        """Forget the k oldest stored rounds."""
+        groups = k * self.num_peers
+        rows = self.starts[groups] - self.dropped
+        for column in self.columns:
+            del column[:rows]
+        del self.starts[:groups]
+        self.dropped += rows
+        self.first_round += k
+
+    def write(self, f):
+        """Write the table at f's current position."""
+        f.write(struct.pack("=iii", len(self.columns), len(self.columns[0]),
+                            self.first_round))
+        for (name, column) in zip(self.names, self.columns):
+            f.write(struct.pack("=i", len(name)) + name.encode("ascii"))
+            f.write(struct.pack("=ci", column.typecode.encode("ascii"),
+                                column.itemsize))
+        starts = array('l', [s - self.dropped for s in self.starts])
+        f.write(struct.pack("=i", len(starts)))
+        for a in self.columns + [starts]:
+            _pad(f)
+            a.tofile(f)
+
+
+def _pad(f, align=8):
+    f.write(b"\0" * (-f.tell() % align))
+
+
+def _column(buf, f, offset, typecode, count):
+    """Read a column starting at offset: a view on buf, or a copy from f."""
+    if np is not None:
+        return np.frombuffer(buf, np.dtype(typecode), count, offset)
+    a = array(typecode)
+    f.seek(offset)
+    a.fromfile(f, count)
+    return a
+
+
+class SavedTable:
+    """An EventTable read back from a file by load()."""
+
+    def __init__(self, buf, f, offset, num_peers):
+        self.num_peers = num_peers
+        (ncols, nrows, self.first_round) = struct.unpack_from("=iii", buf, offset)
+        offset += 12
+        specs = []
+        for i in range(ncols):
+            (n,) = struct.unpack_from("=i", buf, offset)
+            name = buf[offset + 4:offset + 4 + n].decode("ascii")
+            offset += 4 + n
+            (code, size) = struct.unpack_from("=ci", buf, offset)
+            offset += struct.calcsize("=ci")
+            specs.append((name, code.decode("ascii"), size))
+        (nstarts,) = struct.unpack_from("=i", buf, offset)
+        offset += 4
+
+        self.names = [name for (name, code, size) in specs]
+        self.columns = dict()
+        for (name, code, size) in specs + [("starts", "l", array('l').itemsize)]:
+            offset += -offset % 8
+            count = nstarts if name == "starts" else nrows
+            self.columns[name] = _column(buf, f, offset, code, count)
+            offset += count * size
+        self.starts = self.columns.pop("starts")
+        self.num_rows = nrows
+        self.end = offset
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return self.num_rows
+
+
+def save(path, peer_ids, downloads, uploads):
+    """Write the peer id table and both EventTables to path."""
+    with open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("=ii", VERSION, len(peer_ids)))
+        for pid in peer_ids:
+            b = pid.encode("utf-8")
+            f.write(struct.pack("=i", len(b)) + b)
+        for table in (downloads, uploads):
+            _pad(f)
+            table.write(f)
+
+
+class SavedHistory:
+    """
+    A history file mapped back into memory.
+
+    peer_ids: the interned peer ids, so peer_ids[from_idx] is the sender.
+    downloads, uploads: SavedTables; downloads["blocks"] etc. are columns.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self.buf
+        if buf[:4] != MAGIC:
+            raise ValueError("%s is not a saved history" % path)
+        (version, num_peers) = struct.unpack_from("=ii", buf, 4)
+        if version != VERSION:
+            raise ValueError("Unsupported history file version %d" % version)
+        offset = 12
+        self.peer_ids = []
+        for i in range(num_peers):
+            (n,) = struct.unpack_from("=i", buf, offset)
+            self.peer_ids.append(buf[offset + 4:offset + 4 + n].decode("utf-8"))
+            offset += 4 + n
+        offset += -offset % 8
+        self.downloads = SavedTable(buf, self.file, offset, num_peers)
+        offset = self.downloads.end
+        offset += -offset % 8
+        self.uploads = SavedTable(buf, self.file, offset, num_peers)
+
+
+def load(path):
+    """Map a file written by save() (e.g. by History.save) back in."""
+    return SavedHistory(path)
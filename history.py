@@ -3,6 +3,42 @@
 import copy
 import pprint
 
+import events
+from messages import Upload, Download
+
+
+class RoundWindow(object):
+    """
+    Read-only view of the per-round lists History keeps for one peer.
+    Indexing and slicing work like a list (history.downloads[-2:]), but
+    nothing is copied until an agent asks for a slice, and the view always
+    reflects the latest round.
+
+    If History was given a retention limit, only the most recent rounds are
+    kept, so index 0 is the oldest _retained_ round.
+    """
+
+    __slots__ = ("_rounds",)
+
+    def __init__(self, rounds):
+        self._rounds = rounds
+
+    def __len__(self):
+        return len(self._rounds)
+
+    def __getitem__(self, i):
+        return self._rounds[i]
+
+    def __iter__(self):
+        return iter(self._rounds)
+
+    def last(self, k):
+        """The last k rounds, oldest first."""
+        return self._rounds[-k:] if k > 0 else []
+
+    def __repr__(self):
+        return pprint.pformat(self._rounds)
+
 
 class AgentHistory:
     """
@@ -14,22 +50,49 @@ class AgentHistory:
     history.uploads: [[Upload objects for round]]  (one sublist for each round)
          All the downloads _from_ this agent.
 
+    Both are read-only RoundWindow views.  When the sim keeps a limited
+    number of rounds they only hold the most recent ones, so use
+    current_round() rather than len(history.downloads) to tell the time.
+
+    received_from(peer_id) and received_totals() give the blocks downloaded
+    from each peer over the whole run, without walking the rounds.
     """
 
-    def __init__(self, peer_id, downloads, uploads):
+    def __init__(self, peer_id, downloads, uploads, history=None):
         """
-        Pull out just the info for peer_id.
+        Pull out just the info for peer_id.  history is the History that
+        owns downloads and uploads, if any.
         """
-        self.uploads = uploads
-        self.downloads = downloads
+        self.uploads = RoundWindow(uploads)
+        self.downloads = RoundWindow(downloads)
         self.peer_id = peer_id
+        self._history = history
 
     def last_round(self):
-        return len(self.downloads) - 1
+        return self.current_round() - 1
 
     def current_round(self):
         """ 0 is the first """
-        return len(self.downloads)
+        if self._history is None:
+            return len(self.downloads)
+        return self._history.rounds
+
+    def received_from(self, from_id):
+        """Total blocks downloaded from from_id so far."""
+        if self._history is None:
+            return sum(d.blocks for ds in self.downloads for d in ds
+                       if d.from_id == from_id)
+        return self._history.received[self.peer_id].get(from_id, 0)
+
+    def received_totals(self):
+        """dict : peer_id -> total blocks downloaded from that peer so far"""
+        if self._history is None:
+            totals = dict()
+            for ds in self.downloads:
+                for d in ds:
+                    totals[d.from_id] = totals.get(d.from_id, 0) + d.blocks
+            return totals
+        return dict(self._history.received[self.peer_id])
 
     def __repr__(self):
         return "AgentHistory(downloads=%s, uploads=%s)" % (
@@ -38,68 +101,197 @@ class AgentHistory:
         )
 
 
+def _number(x, was_int):
+    """Columns store counts as doubles; give back ints the sim recorded as
+    ints, and floats as floats."""
+    return int(x) if was_int else x
+
+
+class PeerRounds(object):
+    """
+    One peer's rounds in one of History's EventTables, as a sequence with
+    one tuple of Download (or Upload) objects per retained round.  The
+    objects are only built when a round is looked at.
+    """
+
+    __slots__ = ("history", "table", "peer_idx", "make")
+
+    def __init__(self, history, table, peer_idx, make):
+        self.history = history
+        self.table = table
+        self.peer_idx = peer_idx
+        self.make = make  # (ids, columns, row) -> Download or Upload
+
+    def __len__(self):
+        return self.history.rounds - self.history.first_round
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("round index out of range")
+        h = self.history
+        columns = self.table.columns
+        rows = self.table.rows(h.first_round + i, self.peer_idx)
+        return tuple(self.make(h.peer_ids, columns, row) for row in rows)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return pprint.pformat(list(self))
+
+
+def _make_download(ids, columns, row):
+    (round, from_idx, to_idx, piece, blocks, blocks_int) = columns
+    return Download(ids[from_idx[row]], ids[to_idx[row]], piece[row],
+                    _number(blocks[row], blocks_int[row]))
+
+
+def _make_upload(ids, columns, row):
+    (round, from_idx, to_idx, bw, bw_int) = columns
+    return Upload(ids[from_idx[row]], ids[to_idx[row]],
+                  _number(bw[row], bw_int[row]))
+
+
 class History:
     """History of the whole sim"""
 
-    def __init__(self, peer_ids, upload_rates):
+    def __init__(self, peer_ids, upload_rates, retain=None):
         """
         uploads:
-                   dict : peer_id -> [[uploads] -- one list per round]
+                   dict : peer_id -> [(uploads) -- one tuple per round]
         downloads:
-                   dict : peer_id -> [[downloads] -- one list per round]
+                   dict : peer_id -> [(downloads) -- one tuple per round]
                    
         Keep track of the uploads _from_ and downloads _to_ the
         specified peer id.
+
+        Both are views over columnar EventTables (see events.py), with peer
+        ids interned to their index in peer_ids; save() writes those
+        tables out in a compact binary form.
+
+        retain: if not None, only keep the last `retain` rounds of uploads
+        and downloads, so memory stays bounded on long runs.  Totals and
+        completion rounds are still kept for the whole run.
         """
         self.upload_rates = upload_rates  # peer_id -> up_bw
         self.peer_ids = peer_ids[:]
+        self.index = dict((pid, i) for (i, pid) in enumerate(peer_ids))
+        self.retain = retain
 
+        self.rounds = 0       # number of rounds recorded
+        self.first_round = 0  # round number of the oldest retained round
         self.round_done = dict()  # peer_id -> round finished
-        self.downloads = dict((pid, []) for pid in peer_ids)
-        self.uploads = dict((pid, []) for pid in peer_ids)
+        self.overruns = dict((pid, 0) for pid in peer_ids)  # calls over budget
+
+        n = len(peer_ids)
+        self.download_events = events.EventTable(n, events.DOWNLOAD_COLUMNS)
+        self.upload_events = events.EventTable(n, events.UPLOAD_COLUMNS)
+        self.downloads = dict(
+            (pid, PeerRounds(self, self.download_events, i, _make_download))
+            for (i, pid) in enumerate(peer_ids))
+        self.uploads = dict(
+            (pid, PeerRounds(self, self.upload_events, i, _make_upload))
+            for (i, pid) in enumerate(peer_ids))
+        # to_id -> from_id -> total blocks downloaded
+        self.received = dict((pid, dict()) for pid in peer_ids)
+
+        self.views = dict(
+            (pid, AgentHistory(pid, self.downloads[pid], self.uploads[pid], self))
+            for pid in peer_ids)
 
     def update(self, dls, ups):
         """
-        dls: dict : peer_id -> [downloads] -- downloads for this round
-        ups: dict : peer_id -> [uploads] -- uploads for this round
+        dls: [[(from index, piece, blocks)]] -- the downloads to each peer
+             this round, one list per peer in peer_ids order, with the
+             sender given by its index in peer_ids
+        ups: [[uploads]] -- each peer's Upload objects this round, one list
+             per peer in peer_ids order
 
         append these downloads to to the history
         """
-        for pid in self.peer_ids:
-            self.downloads[pid].append(dls[pid])
-            self.uploads[pid].append(ups[pid])
+        r = self.rounds
+        idx = self.index
+        ids = self.peer_ids
+        self.download_events.append_round(
+            [[(r, from_idx, to_idx, piece, blocks, not isinstance(blocks, float))
+              for (from_idx, piece, blocks) in ds]
+             for (to_idx, ds) in enumerate(dls)])
+        self.upload_events.append_round(
+            [[(r, from_idx, idx[u.to_id], u.bw, not isinstance(u.bw, float))
+              for u in us]
+             for (from_idx, us) in enumerate(ups)])
+        for (pid, ds) in zip(ids, dls):
+            received = self.received[pid]
+            for (from_idx, piece, blocks) in ds:
+                from_id = ids[from_idx]
+                received[from_id] = received.get(from_id, 0) + blocks
+        self.rounds += 1
+
+        if self.retain is not None:
+            self.first_round = max(0, self.rounds - self.retain)
+            # Trim the tables in batches, once they hold twice what we keep
+            stored = self.download_events.rounds()
+            if stored > 2 * self.retain:
+                for table in (self.download_events, self.upload_events):
+                    table.drop_rounds(stored - self.retain)
+
+    def save(self, path):
+        """Write the retained rounds to path; read back with events.load."""
+        # The tables are trimmed in batches, so they may still hold up to
+        # twice the rounds we retain
+        stored = self.download_events.rounds()
+        if self.retain is not None and stored > self.retain:
+            for table in (self.download_events, self.upload_events):
+                table.drop_rounds(stored - self.retain)
+        events.save(path, self.peer_ids, self.download_events, self.upload_events)
 
     def peer_is_done(self, round, peer_id):
         # Only save the _first_ round where we hear this
         if peer_id not in self.round_done:
             self.round_done[peer_id] = round
 
+    def peer_over_budget(self, peer_id):
+        """Count a requests() or uploads() call that ran over the time budget."""
+        self.overruns[peer_id] += 1
+
     def peer_history(self, peer_id):
-        return AgentHistory(peer_id, self.downloads[peer_id], self.uploads[peer_id])
+        """A live, read-only view of peer_id's history."""
+        return self.views[peer_id]
 
     def last_round(self):
         """index of the last completed round"""
-        p = self.peer_ids[0]
-        return len(self.downloads[p]) - 1
+        return self.rounds - 1
 
     def pretty_for_round(self, r):
-        s = "\nRound %s:\n" % r
+        return "".join(self._pretty_lines(r))
+
+    def _pretty_lines(self, r):
+        yield "\nRound %s:\n" % r
+        if r < self.first_round:
+            yield "(not retained)\n"
+            return
         for peer_id in self.peer_ids:
-            ds = self.downloads[peer_id][r]
-            stringify = lambda d: "%s downloaded %d blocks of piece %d from %s\n" % (
-                peer_id,
-                d.blocks,
-                d.piece,
-                d.from_id,
-            )
-            s += "".join(map(stringify, ds))
-        return s
+            for d in self.downloads[peer_id][r - self.first_round]:
+                yield "%s downloaded %d blocks of piece %d from %s\n" % (
+                    peer_id,
+                    d.blocks,
+                    d.piece,
+                    d.from_id,
+                )
 
     def pretty(self):
-        s = "History\n"
-        for r in range(self.last_round() + 1):
-            s += self.pretty_for_round(r)
-        return s
+        # One join at the end rather than repeated concatenation, which was
+        # quadratic in the length of the run
+        lines = ["History\n"]
+        for r in range(self.first_round, self.last_round() + 1):
+            lines.extend(self._pretty_lines(r))
+        return "".join(lines)
 
     def __repr__(self):
         return """History(
@@ -1,6 +1,5 @@
 #!/usr/bin/python
 
-import random
 
 from math import floor
 from operator import itemgetter
@@ -30,14 +29,15 @@ class KrankilePropshare(KrankileStd):
 
         # Initialize a counter for keeping track of how much people let us download last round
         uploader_c = Counter()
-        last = history.downloads[-1]
+        self.ledger.update(history)
+        last = self.ledger.last_round()
 
         # Get a set of all peers who requested pieces from us
         requester_ids = set(x.requester_id for x in requests)
 
-        for download in last:
-            if download.from_id in requester_ids:
-                uploader_c.update({download.from_id: download.blocks})
+        for (peer_id, blocks) in last.items():
+            if peer_id in requester_ids:
+                uploader_c[peer_id] = blocks
 
         total = sum(uploader_c.values())
 
@@ -58,7 +58,7 @@ class KrankilePropshare(KrankileStd):
         # If there is peers to choose from, add one to optimistically unchoke
         if bool(peer_ids):
             id_and_bw.append(
-                [random.choice(list(peer_ids)), floor(self.up_bw*0.1)])
+                [self.rng.choice(list(peer_ids)), floor(self.up_bw*0.1)])
 
         # If there is bw not used -> distribute it evenly across the peers we are unchoking
         id_and_bw = sorted(id_and_bw, key=itemgetter(1), reverse=True)
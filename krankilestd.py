@@ -1,14 +1,21 @@
 #!/usr/bin/python
-import random
 
 from collections import Counter
-from itertools import chain
 from messages import Upload, Request
+from pieces import PieceSet
+from ledger import Ledger
+from spread import spread_requests
 from util import even_split
 from peer import Peer
 
 
 class KrankileStd(Peer):
+    idle_requests = True
+    idle_uploads = True
+    # Switch to endgame requests once there are no more pieces left than
+    # this many peers' worth of requests
+    endgame_peers = 3
+
     def post_init(self):
         # To generalise the agent somewhat
         self.normal_slots = 3
@@ -17,6 +24,9 @@ class KrankileStd(Peer):
         # To hold the peer that is currently being optimistically unchoked
         self.optimistic_unchoke = None
 
+        # What each peer has uploaded to us in the last two rounds
+        self.ledger = Ledger(window=2)
+
     def requests(self, peers, history):
         """
         peers: available info about the peers (who has what pieces)
@@ -28,37 +38,58 @@ class KrankileStd(Peer):
         """
         # Find all the pieces we ned
         def needed(i): return self.pieces[i] < self.conf.blocks_per_piece
-        needed_pieces = set(filter(needed, range(len(self.pieces))))
+        needed_pieces = PieceSet.from_ids(filter(needed, range(len(self.pieces))))
+
+        # Once only a few pieces are left, ask every peer for all of them
+        endgame = len(needed_pieces) <= self.endgame_peers * self.max_requests
 
-        # Create a datastructure for tallying up what pieces are the most rare
-        piece_counter = Counter()
-        for peer in peers:
-            av = set(peer.available_pieces)
-            av_needed = av.intersection(needed_pieces)
-            piece_counter.update(av_needed)
+        # The pieces to ask each peer for, rarest first.  The sim keeps
+        # track of how many peers have each piece.
+        asked = spread_requests(peers, needed_pieces, self.rarity.rarest,
+                                self.max_requests, endgame)
+
+        if self.conf.block_ranges:
+            return self.range_requests(asked)
 
         # List to keep all requests we want to send out
         requests = []
-
-        # Go through each peer and ask for the n most rare pieces they have and we want
-        for peer in peers:
-            available_piece_set = set(peer.available_pieces)
-            # We can only ask for pieces we (1) need and (2) the peer actually has
-            needed_and_available = available_piece_set.intersection(
-                needed_pieces)
-            # Check how many pieces we can maximally request
-            num_pieces = min(self.max_requests, len(needed_and_available))
-
-            # Sort the pieces based on how many peers actually have the piece, rarest first
-            rarest_first = sorted(
-                list(needed_and_available), lambda p1, p2: piece_counter[p1] - piece_counter[p2])
-            for piece_id in rarest_first[:num_pieces]:
+        for (peer, piece_ids) in asked:
+            for piece_id in piece_ids:
                 start_block = self.pieces[piece_id]
                 request = Request(self.id, peer.id, piece_id, start_block)
                 requests.append(request)
 
         return requests
 
+    def range_requests(self, asked):
+        """
+        With --block-ranges: split the blocks of each piece evenly between
+        the peers it is asked of, so they upload different parts of it.
+        Each peer is then asked for the whole of those pieces, after its
+        own shares, so that its leftover bandwidth fills in blocks another
+        peer didn't send.
+        """
+        bpp = self.conf.blocks_per_piece
+        askers = Counter()
+        for (peer, piece_ids) in asked:
+            askers.update(piece_ids)
+        shares = Counter()  # piece_id -> shares handed out so far
+        requests = []
+        for (peer, piece_ids) in asked:
+            shared = []
+            for piece_id in piece_ids:
+                (j, k) = (shares[piece_id], askers[piece_id])
+                shares[piece_id] += 1
+                (start, end) = (j * bpp // k, (j + 1) * bpp // k)
+                if start < end:
+                    requests.append(Request(self.id, peer.id, piece_id,
+                                            start, end))
+                if k > 1:
+                    shared.append(piece_id)
+            for piece_id in shared:
+                requests.append(Request(self.id, peer.id, piece_id, 0, bpp))
+        return requests
+
     def uploads(self, requests, peers, history):
         """
         requests -- a list of the requests for this peer for this round
@@ -77,15 +108,13 @@ class KrankileStd(Peer):
         # Initialize a counter to keep track of how much the agent downloaded from all other
         # peers the last two rounds
         uploader_c = Counter()
-        two_last = history.downloads[-2:]
+        self.ledger.update(history)
         requester_ids = set(x.requester_id for x in requests)
 
-        # Iterate over all download objects that we recieved the previous two rounds
-        for download in chain(*two_last):
-            # Only count the downloads that are from a peer that actually requested a piece from us
-            # requster_ids is a set so this operation is luckily O(1)
-            if download.from_id in requester_ids:
-                uploader_c.update({download.from_id: download.blocks})
+        # Only count the peers that actually requested a piece from us
+        for (peer_id, blocks) in self.ledger.received_totals().items():
+            if peer_id in requester_ids:
+                uploader_c[peer_id] = blocks
 
         # Choose the n peers who uploaded most to us as the ones we are going to reciprocate
         # Choose n to be the smaller of how many normal slots there are and how many requesters there are
@@ -96,8 +125,8 @@ class KrankileStd(Peer):
         # If there still are peers left to unchoke
         # Select a peer to optimistically unchoke if we either do not currently have unchoked anyone
         # or if 3 rounds have passed
-        if bool(peer_ids) and (len(history.downloads) % self.optimistic_unchoke_interval == 0 or not self.optimistic_unchoke):
-            unchoke = random.choice(list(peer_ids))
+        if bool(peer_ids) and (history.current_round() % self.optimistic_unchoke_interval == 0 or not self.optimistic_unchoke):
+            unchoke = self.rng.choice(list(peer_ids))
             self.optimistic_unchoke = unchoke
 
         # Add the optimistically unchoked peer to the set
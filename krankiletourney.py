@@ -1,12 +1,15 @@
 #!/usr/bin/python
 
-import random
 from messages import Upload, Request
+from pieces import PieceSet
+from spread import spread_requests
 from util import even_split
 from peer import Peer
 
 
 class KrankileTourney(Peer):
+    # requests() samples pieces at random, so only uploads() can be skipped
+    idle_uploads = True
 
     def post_init(self):
         # For making it easier to change parameters
@@ -25,23 +28,21 @@ class KrankileTourney(Peer):
         """
 
         # Find the pieces we need
-        needed_pieces = list(
-            set(filter(self.piece_needed, range(len(self.pieces)))))
+        needed_pieces = PieceSet.from_ids(
+            filter(self.piece_needed, range(len(self.pieces))))
+
+        # Ask each peer for a random sample of the pieces we need and it has,
+        # to break symmetry
+        def sample(pieces, k):
+            return self.rng.sample(list(pieces), min(k, len(pieces)))
 
         # Initialize an array to hold the request objects we are going to send
         requests = []
 
         # Iterate through all peers to make requests for their pieces
-        for peer in peers:
-
-            # Start by finding all pieces we need and this peer also has
-            # Also find the maximium amount of requests to send to this peer
-            available_pieces = set(peer.available_pieces)
-            needed_and_available = available_pieces.intersection(needed_pieces)
-            max_requests = min(self.max_requests, len(needed_and_available))
-
-            # Iterate through a random sample of the pieces we identified to break symmetry
-            for piece_id in random.sample(needed_and_available, max_requests):
+        for (peer, piece_ids) in spread_requests(peers, needed_pieces, sample,
+                                                 self.max_requests):
+            for piece_id in piece_ids:
                 start_block = self.pieces[piece_id]
                 request = Request(self.id, peer.id, piece_id, start_block)
                 requests.append(request)
@@ -69,7 +70,7 @@ class KrankileTourney(Peer):
         # This again break symmetry and makes us somewhat strategy proof (more on that in the writeup)
         # Also, this makes the likelihood of being reciprocated very large
         # since we give away so much bw to a few peers
-        chosen_requests = random.sample(requests, n_slots)
+        chosen_requests = self.rng.sample(requests, n_slots)
         chosen = [request.requester_id for request in chosen_requests]
 
         # Distribute the bw among the chosen peers
@@ -1,8 +1,8 @@
-import random
 import math
-from collections import defaultdict, Counter
+from collections import defaultdict
 
 from messages import Upload
+from ledger import Ledger
 from krankilestd import KrankileStd
 
 
@@ -10,6 +10,9 @@ class KrankileTyrant(KrankileStd):
     # This client uses the same requesting strategy as the standard client,
     # so we chose to jsut let it inherit the request method from that.
 
+    # uploads() updates its estimates every round, requests or not
+    idle_uploads = False
+
     def post_init(self):
         # Step 1 in algorithm 5.11
         self.alpha = 0.20
@@ -22,7 +25,7 @@ class KrankileTyrant(KrankileStd):
         # get from a given peer, we instead use the knowledge of the range of different upload
         # bandwidths that exists, and divide that by 4 on an assumption of that is what the
         # reference client is using.
-        self.downloads = defaultdict(lambda: random.randint(
+        self.downloads = defaultdict(lambda: self.rng.randint(
             self.conf.min_up_bw, self.conf.max_up_bw) / 4.0)
 
         # Make an initial for upload required for reciprocation u_{ij}
@@ -33,6 +36,9 @@ class KrankileTyrant(KrankileStd):
         self.upload_bws = defaultdict(lambda: max(
             (self.conf.min_up_bw + self.conf.max_up_bw) / (2.0 * 3), self.up_bw / 3.0))
 
+        # What each peer uploaded to us, and for how many rounds in a row
+        self.ledger = Ledger(window=self.r)
+
     # Calculate the ratio between estimated donload rateto estimated required upload
     # rate for a peer used in the sorting
     def get_ratio(self, id_):
@@ -57,8 +63,9 @@ class KrankileTyrant(KrankileStd):
         # should be the same as updating the values after a round.
         if history.current_round() != 0:
             # We have completed 1 round and we have history
-            unchoked_ids = set(
-                download.from_id for download in history.downloads[-1])
+            self.ledger.update(history)
+            last = self.ledger.last_round()
+            unchoked_ids = set(last)
 
             # Step 5 a)
             # Find the set of peers in the neighborhood that has not unchoked this agent
@@ -69,24 +76,17 @@ class KrankileTyrant(KrankileStd):
                     self.upload_bws[peer_id] * (1 + self.alpha), self.up_bw / 3.0)
 
             # Step 5 b)
-            # A map of peers that unchoked this agent last period and how much bw we received
-            unchoked_counter = Counter()
-            unchoked_list = [(download.from_id, download.blocks)
-                             for download in history.downloads[-1]]
-            for id_, blocks in unchoked_list:
-                unchoked_counter.update({id_: blocks})
-
-            for peer_id, rate in unchoked_counter.items():
+            # The peers that unchoked this agent last period and how much bw we received
+            for peer_id, rate in last.items():
                 # Update the estimated download rate from a peer with the actual, observed value
                 self.downloads[peer_id] = float(rate)
 
             # Step 5 c)
-            # Initialize the set for holding the set of peers that
-            # uploaded to this agent for the last r periods
-            unchoked_r_last = set(unchoked_ids)
-            for downloads in history.downloads[-self.r:-1]:
-                unchoked_r_last = unchoked_r_last.intersection(
-                    set(download.from_id for download in downloads))
+            # The peers that uploaded to this agent for the last r periods
+            # (or every period so far, if there haven't been r yet)
+            r = min(self.r, self.ledger.rounds)
+            unchoked_r_last = [peer_id for peer_id in unchoked_ids
+                               if self.ledger.streak(peer_id) >= r]
 
             # Slowly decrease the bw we give to these peers while they
             # hopefully still reciprocates
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+
+from collections import deque
+
+
+class Ledger:
+    """
+    A tit-for-tat agent's record of what each peer has uploaded to it.
+
+    Call update(history) at the start of uploads() each round.  It folds in
+    just the rounds it hasn't seen yet, keeping:
+
+      - the blocks each peer sent in each of the last `window` rounds,
+        for received(peer_id, rounds) and received_totals(),
+      - an exponentially weighted moving average of each peer's blocks per
+        round, for rate(peer_id),
+      - how many rounds in a row, up to the last one, each peer has
+        uploaded to us, for streak(peer_id),
+
+    so the agent can look up each requester directly instead of rescanning
+    its download history.
+    """
+
+    def __init__(self, window=3, alpha=0.5):
+        """
+        window: number of recent rounds to keep per-round totals for.
+        alpha: weight of the latest round in the moving average.
+        """
+        self.window = window
+        self.alpha = alpha
+        self.rounds = 0  # rounds folded in so far
+        self.recent = deque(maxlen=window)  # [peer_id -> blocks], oldest first
+        self.totals = dict()  # peer_id -> blocks over the whole window
+        self.streaks = dict()  # peer_id -> rounds in a row
+        # peer_id -> (moving average of blocks / round, as of round).  It
+        # decays by (1 - alpha) for each round after that with no uploads,
+        # which is applied when it is read, so quiet peers cost nothing.
+        self.rates = dict()
+
+    def update(self, history):
+        """Fold in the rounds of history since the last update."""
+        behind = history.current_round() - self.rounds
+        kept = len(history.downloads)
+        for k in range(behind, 0, -1):
+            # Rounds the history no longer retains count as empty
+            self.add_round(history.downloads[-k] if k <= kept else [])
+
+    def add_round(self, downloads):
+        """Fold in one round's Download objects."""
+        got = dict()
+        for d in downloads:
+            got[d.from_id] = got.get(d.from_id, 0) + d.blocks
+        self.recent.append(got)
+        totals = dict()
+        for r in self.recent:
+            for (peer_id, blocks) in r.items():
+                totals[peer_id] = totals.get(peer_id, 0) + blocks
+        self.totals = totals
+        self.streaks = dict((peer_id, self.streaks.get(peer_id, 0) + 1)
+                            for peer_id in got)
+        for (peer_id, blocks) in got.items():
+            rate = (1 - self.alpha) * self.rate(peer_id) + self.alpha * blocks
+            self.rates[peer_id] = (rate, self.rounds)
+        self.rounds += 1
+
+    def received(self, peer_id, rounds=None):
+        """Blocks peer_id sent us in the last `rounds` rounds (at most
+        window; default: the whole window)."""
+        if rounds is None or rounds >= len(self.recent):
+            return self.totals.get(peer_id, 0)
+        total = 0
+        for i in range(len(self.recent) - rounds, len(self.recent)):
+            total += self.recent[i].get(peer_id, 0)
+        return total
+
+    def received_totals(self):
+        """dict : peer_id -> blocks over the window, for the peers that
+        sent us anything in it.  Don't modify it."""
+        return self.totals
+
+    def last_round(self):
+        """dict : peer_id -> blocks, for the peers that sent us anything
+        last round."""
+        return self.recent[-1] if self.recent else dict()
+
+    def streak(self, peer_id):
+        return self.streaks.get(peer_id, 0)
+
+    def rate(self, peer_id):
+        if peer_id not in self.rates:
+            return 0
+        (rate, as_of) = self.rates[peer_id]
+        return rate * (1 - self.alpha) ** (self.rounds - 1 - as_of)
@@ -1,7 +1,14 @@
 #!/usr/bin/python
 
+# The sim allocates these by the hundred thousand, so they use __slots__
+# instead of a per-instance __dict__.
+
+from itertools import chain, islice
+
+
+class Upload(object):
+    __slots__ = ("from_id", "to_id", "bw")
 
-class Upload:
     def __init__(self, from_id, to_id, up_bw):
         self.from_id = from_id
         self.to_id = to_id
@@ -15,14 +22,23 @@ class Upload:
         )
 
 
-class Request:
-    def __init__(self, requester_id, peer_id, piece_id, start):
+class Request(object):
+    __slots__ = ("requester_id", "peer_id", "piece_id", "start", "end")
+
+    def __init__(self, requester_id, peer_id, piece_id, start, end=None):
         self.requester_id = requester_id
         self.peer_id = peer_id  # peer data is requested from
         self.piece_id = piece_id
         self.start = start  # the block index
+        # With --block-ranges, the block index to stop before (None: the
+        # end of the piece)
+        self.end = end
 
     def __repr__(self):
+        if self.end is not None:
+            return ("Request(requester_id=%s, peer_id=%s, piece_id=%d, "
+                    "start=%d, end=%d)" % (self.requester_id, self.peer_id,
+                                           self.piece_id, self.start, self.end))
         return "Request(requester_id=%s, peer_id=%s, piece_id=%d, start=%d)" % (
             self.requester_id,
             self.peer_id,
@@ -31,11 +47,13 @@ class Request:
         )
 
 
-class Download:
+class Download(object):
     """ Not actually a message--just used for accounting and history tracking of
      what is actually downloaded.
     """
 
+    __slots__ = ("from_id", "to_id", "piece", "blocks")
+
     def __init__(self, from_id, to_id, piece, blocks):
         self.from_id = from_id  # who did the agent download from?
         self.to_id = to_id      # Who downloaded?
@@ -51,15 +69,60 @@ class Download:
         )
 
 
-class PeerInfo:
+class PeerInfo(object):
     """
     Only passing peer ids and the pieces they have available to each agent.
     This prevents them from accidentally messing up the state of other agents.
+
+    The sim hands the same PeerInfo objects to every agent, so they are
+    read-only, and available_pieces is an immutable pieces.PieceSet.
     """
 
+    __slots__ = ("id", "available_pieces")
+
     def __init__(self, id, available):
-        self.id = id
-        self.available_pieces = available
+        object.__setattr__(self, "id", id)
+        object.__setattr__(self, "available_pieces", available)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PeerInfo is read-only")
+
+    __delattr__ = __setattr__
 
     def __repr__(self):
         return "PeerInfo(id=%s)" % self.id
+
+
+class AllBut(object):
+    """
+    Read-only view of a round's tuple of PeerInfo, leaving out the peer at
+    index skip -- the agent it is handed to.  Indexing, iteration and len
+    work like the list of other peers it stands for, in the same order,
+    but nothing is copied unless the agent slices it or makes a list.
+    """
+
+    __slots__ = ("_infos", "_skip")
+
+    def __init__(self, infos, skip):
+        self._infos = infos
+        self._skip = skip
+
+    def __len__(self):
+        return len(self._infos) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self)[i]
+        n = len(self._infos) - 1
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("AllBut index out of range")
+        return self._infos[i + (i >= self._skip)]
+
+    def __iter__(self):
+        infos = self._infos
+        return chain(islice(infos, self._skip), islice(infos, self._skip + 1, None))
+
+    def __repr__(self):
+        return repr(list(self))
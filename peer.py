@@ -6,18 +6,38 @@ from util import even_split
 
 
 class Peer:
-    def __init__(self, config, id, init_pieces, up_bandwidth):
+    # Agents can promise the sim that some calls can be skipped, which it
+    # does when run with --skip-idle:
+    #
+    # idle_requests: requests() depends only on this peer's pieces, the
+    # other peers' available pieces and rarity, so last round's
+    # requests are reused while none of those has changed.
+    idle_requests = False
+    # idle_uploads: uploads() returns [] and changes no state when there
+    # are no requests, so it isn't called then.
+    idle_uploads = False
+
+    def __init__(self, config, id, init_pieces, up_bandwidth, rng=None):
+        """
+        rng: this peer's random.Random stream.  Agents should make their
+        random choices with self.rng rather than the global random module,
+        so that a seeded run is reproducible.
+        """
         self.conf = config
         self.id = id
         self.pieces = init_pieces[:]
         # bandwidth measured in blocks-per-time-period
         self.up_bw = up_bandwidth
+        self.rng = rng or random
 
         # This is an upper bound on the number of requests to send to
         # each peer -- they can't possibly handle more than this in one round
         self.max_requests = self.conf.max_up_bw / self.conf.blocks_per_piece + 1
         self.max_requests = min(self.max_requests, self.conf.num_pieces)
 
+        # How many peers have each piece; set by the sim every round
+        self.rarity = None
+
         self.post_init()
 
     def __repr__(self):
@@ -35,6 +55,14 @@ class Peer:
         """
         self.pieces = new_pieces
 
+    def update_rarity(self, rarity):
+        """
+        Called by the sim before requests() with a pieces.RarityView: a
+        read-only sequence of how many peers in the swarm have each piece,
+        which can also pick the rarest pieces of a set (rarity.rarest).
+        """
+        self.rarity = rarity
+
     def requests(self, peers, history):
         return []
 
@@ -0,0 +1,329 @@
+#!/usr/bin/python
+
+
+class PieceStore:
+    """
+    The simulation's record of how many blocks of each piece every peer has.
+    Peers are referred to by their index in the sim's peer list.
+
+    Block counts live in one flat peers x pieces list (row-major, one row
+    per peer) that is updated in place.  It is a plain list rather than an
+    array since agents are free to upload fractional bandwidths.
+
+    Downloads for a round are buffered with add() and applied together by
+    apply(), so the counts seen while a round is being processed are always
+    those from the start of the round.
+
+    Agents never see the list itself: pieces() hands out a fresh list.
+
+    It also keeps, per peer, the number of pieces still missing, and the set
+    of peers that are not done yet, so completion checks don't have to
+    rescan the block counts.
+
+    With ranges on (sim.py --block-ranges), blocks can arrive out of order,
+    so it also keeps a bitmap of which blocks of each piece every peer has,
+    in a flat list parallel to the counts, and downloads are buffered with
+    add_blocks() instead of add().
+    """
+
+    def __init__(self, num_pieces, blocks_per_piece, init_pieces, ranges=False):
+        """
+        init_pieces: [[blocks / piece]], one list per peer, each piece's
+        blocks being the first ones
+        """
+        self.num_pieces = num_pieces
+        self.blocks_per_piece = blocks_per_piece
+
+        self.blocks = []
+        for pieces in init_pieces:
+            self.blocks.extend(pieces)
+
+        self.deltas = []  # [(offset, blocks)] -- pending for this round
+
+        # Block bitmaps (bit i set: have block i), and the ones pending for
+        # this round as [(offset, bitmap)], or None without ranges
+        self.maps = None
+        self.map_deltas = None
+        if ranges:
+            self.maps = [(1 << int(b)) - 1 for b in self.blocks]
+            self.map_deltas = []
+
+        # peer index -> number of pieces with fewer than blocks_per_piece
+        self.missing = [sum(1 for b in pieces if b < blocks_per_piece)
+                        for pieces in init_pieces]
+        self.unfinished = set(i for (i, n) in enumerate(self.missing) if n > 0)
+        # Done since the last pop_newly_done().  Starts with the peers that
+        # were done from the beginning, e.g. seeds.
+        self.newly_done = [i for i in range(len(init_pieces))
+                           if i not in self.unfinished]
+
+    def pieces(self, i):
+        """A copy of peer i's blocks-per-piece list."""
+        start = i * self.num_pieces
+        return self.blocks[start:start + self.num_pieces]
+
+    def get(self, i, piece_id):
+        return self.blocks[i * self.num_pieces + piece_id]
+
+    def block_map(self, i, piece_id):
+        """Bitmap of the blocks of piece_id peer i has (ranges only)."""
+        return self.maps[i * self.num_pieces + piece_id]
+
+    def add(self, i, piece_id, blocks):
+        """Buffer a download of blocks of piece_id by peer i."""
+        self.deltas.append((i * self.num_pieces + piece_id, blocks))
+
+    def add_blocks(self, i, piece_id, bitmap):
+        """Buffer a download of the blocks in bitmap (ranges only)."""
+        self.map_deltas.append((i * self.num_pieces + piece_id, bitmap))
+
+    def apply(self):
+        """
+        Apply the buffered downloads in place.
+
+        Returns a list of (peer index, piece_id) for the pieces that were
+        completed by this round's downloads.
+        """
+        if self.map_deltas:
+            maps = self.maps
+            for (offset, bitmap) in self.map_deltas:
+                new = bitmap & ~maps[offset]
+                if new:
+                    maps[offset] |= new
+                    self.deltas.append((offset, bin(new).count("1")))
+            self.map_deltas = []
+        completed = []
+        b = self.blocks
+        bpp = self.blocks_per_piece
+        for (offset, blocks) in self.deltas:
+            old = b[offset]
+            new = b[offset] = old + blocks
+            (i, piece_id) = divmod(offset, self.num_pieces)
+            if new == bpp:
+                completed.append((i, piece_id))
+            if old < bpp <= new:
+                self.missing[i] -= 1
+                if self.missing[i] == 0:
+                    self.unfinished.discard(i)
+                    self.newly_done.append(i)
+        self.deltas = []
+        return completed
+
+    def pop_newly_done(self):
+        """The indices of the peers that finished since the last call."""
+        done = self.newly_done
+        self.newly_done = []
+        return done
+
+
+class PieceSet(object):
+    """
+    An immutable set of piece ids, stored as the bits of one int.
+
+    Supports the read-only operations of a set (iteration in piece order,
+    membership, len, &, |, -, ^, subset tests and comparisons) with
+    intersection and popcount done a machine word at a time.  It can also
+    be indexed, in piece order, so random.choice() works on it.  It is immutable so that the sim can hand the
+    same PieceSet to every agent without them being able to change it.
+    """
+
+    __slots__ = ("bits",)
+
+    def __init__(self, bits=0):
+        self.bits = bits
+
+    @staticmethod
+    def from_ids(piece_ids):
+        bits = 0
+        for i in piece_ids:
+            bits |= 1 << i
+        return PieceSet(bits)
+
+    @staticmethod
+    def coerce(pieces):
+        if isinstance(pieces, PieceSet):
+            return pieces
+        return PieceSet.from_ids(pieces)
+
+    def with_piece(self, piece_id):
+        return PieceSet(self.bits | (1 << piece_id))
+
+    def __contains__(self, piece_id):
+        return piece_id >= 0 and bool((self.bits >> piece_id) & 1)
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            low = bits & -bits
+            yield low.bit_length() - 1
+            bits ^= low
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+    def __getitem__(self, index):
+        """The index-th piece id, in piece order."""
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("PieceSet index out of range")
+        for piece_id in self:
+            if index == 0:
+                return piece_id
+            index -= 1
+
+    def __nonzero__(self):
+        return self.bits != 0
+    __bool__ = __nonzero__
+
+    def __and__(self, other):
+        return PieceSet(self.bits & PieceSet.coerce(other).bits)
+    __rand__ = __and__
+    intersection = __and__
+
+    def __or__(self, other):
+        return PieceSet(self.bits | PieceSet.coerce(other).bits)
+    __ror__ = __or__
+    union = __or__
+
+    def __sub__(self, other):
+        return PieceSet(self.bits & ~PieceSet.coerce(other).bits)
+    difference = __sub__
+
+    def __rsub__(self, other):
+        return PieceSet(PieceSet.coerce(other).bits & ~self.bits)
+
+    def __xor__(self, other):
+        return PieceSet(self.bits ^ PieceSet.coerce(other).bits)
+    __rxor__ = __xor__
+    symmetric_difference = __xor__
+
+    def issubset(self, other):
+        return self.bits & ~PieceSet.coerce(other).bits == 0
+
+    def issuperset(self, other):
+        return PieceSet.coerce(other).bits & ~self.bits == 0
+
+    def isdisjoint(self, other):
+        return self.bits & PieceSet.coerce(other).bits == 0
+
+    def _compared(self, other):
+        """other's bits, for the subset comparisons; sets only, like set's."""
+        if not isinstance(other, (PieceSet, set, frozenset)):
+            raise TypeError("can only compare to a set")
+        return PieceSet.coerce(other).bits
+
+    def __le__(self, other):
+        return self.bits & ~self._compared(other) == 0
+
+    def __lt__(self, other):
+        bits = self._compared(other)
+        return self.bits != bits and self.bits & ~bits == 0
+
+    def __ge__(self, other):
+        return self._compared(other) & ~self.bits == 0
+
+    def __gt__(self, other):
+        bits = self._compared(other)
+        return self.bits != bits and bits & ~self.bits == 0
+
+    def __eq__(self, other):
+        return isinstance(other, PieceSet) and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.bits)
+
+    def __repr__(self):
+        return "PieceSet(%s)" % list(self)
+
+
+def piece_counts(num_pieces, piece_sets):
+    """How many of the given PieceSets contain each piece."""
+    counts = [0] * num_pieces
+    for pieces in piece_sets:
+        for i in pieces:
+            counts[i] += 1
+    return counts
+
+
+class RarityIndex:
+    """
+    How many peers have each piece, kept up to date by the sim as pieces
+    are completed instead of being recounted every round.
+
+    Pieces are also kept in bucket queues by count: buckets[c] holds the
+    bits of the pieces exactly c peers have, so the rarest pieces of any
+    set can be found by walking the buckets up from the lowest count.
+    Agents get a read-only RarityView of it.
+    """
+
+    def __init__(self, counts):
+        """counts: how many peers have each piece, e.g. from piece_counts()"""
+        self.counts = list(counts)
+        self.buckets = [0] * (max(self.counts or [0]) + 1)
+        for (piece_id, c) in enumerate(self.counts):
+            self.buckets[c] |= 1 << piece_id
+        self.changes = 0  # number of add() calls so far
+
+    def add(self, piece_id):
+        """One more peer has piece_id."""
+        c = self.counts[piece_id]
+        self.counts[piece_id] = c + 1
+        bit = 1 << piece_id
+        self.buckets[c] &= ~bit
+        if c + 1 == len(self.buckets):
+            self.buckets.append(0)
+        self.buckets[c + 1] |= bit
+        self.changes += 1
+
+    def rarest(self, pieces, k):
+        """
+        Up to k piece ids from pieces, rarest first, ties broken by piece
+        id -- the same as sorted(pieces, key=counts.__getitem__)[:k].
+        """
+        bits = PieceSet.coerce(pieces).bits
+        found = []
+        for bucket in self.buckets:
+            hit = bucket & bits
+            while hit:
+                if len(found) == k:
+                    return found
+                low = hit & -hit
+                found.append(low.bit_length() - 1)
+                hit ^= low
+            bits &= ~bucket
+            if not bits:
+                break
+        return found[:k]
+
+
+class RarityView(object):
+    """
+    Read-only view of a RarityIndex for agents.  It is a sequence of how
+    many peers have each piece (rarity[piece_id]), and rarest(pieces, k)
+    returns the k rarest of a set of pieces without sorting them.
+    """
+
+    __slots__ = ("_index",)
+
+    def __init__(self, index):
+        self._index = index
+
+    def __getitem__(self, piece_id):
+        return self._index.counts[piece_id]
+
+    def __len__(self):
+        return len(self._index.counts)
+
+    def __iter__(self):
+        return iter(self._index.counts)
+
+    def rarest(self, pieces, k):
+        return self._index.rarest(pieces, k)
+
+    def __repr__(self):
+        return "RarityView(%s)" % self._index.counts
@@ -1,12 +1,14 @@
 #!/usr/bin/python
 
-import random
 from messages import Upload, Request
 from util import even_split
 from peer import Peer
 
 
 class Seed(Peer):
+    idle_requests = True
+    idle_uploads = True
+
     def requests(self, peers, history):
         # Seeds don't need anything.
         return []
@@ -21,7 +23,7 @@ class Seed(Peer):
         bws = even_split(self.up_bw, n)
         uploads = [
             Upload(self.id, p_id, bw)
-            for (p_id, bw) in zip(random.sample(requester_ids, n), bws)
+            for (p_id, bw) in zip(self.rng.sample(requester_ids, n), bws)
         ]
 
         return uploads
@@ -8,25 +8,57 @@ Simulates one file being shared amongst a set of peers.  The file is divided int
 The simulation proceeds in rounds.  In each round, peers can request pieces from other peers, and then decide how much to upload to others.  Once every peer has every piece, the simulation ends.
 """
 
-import re
 import random
 import sys
+import time
 import logging
-import copy
 import itertools
 import pprint
+import multiprocessing
 from optparse import OptionParser
 
-from messages import Upload, Request, Download, PeerInfo
+from messages import Upload, Request, PeerInfo, AllBut
 from util import *
-from stats import Stats
+from stats import Stats, RunSummary
 from history import History
-    
+from pieces import PieceStore, PieceSet, RarityIndex, RarityView, piece_counts
+from vectorsim import VectorSim
+from timing import PhaseTimer, NullTimer, PHASES, write_trace
+
+
+# The shipped agents, whose requests and uploads --trust-agents lets
+# through without validation.
+TRUSTED_AGENTS = set(["Dummy", "Seed", "KrankileStd", "KrankileTyrant",
+                      "KrankilePropshare", "KrankileTourney"])
+
+
+def iteration_seeds(master_seed, iters):
+    """Derive one seed per iteration from the master seed, so a run can be
+    reproduced (serially or in parallel) from the master seed alone."""
+    rng = random.Random(master_seed)
+    return [rng.randint(0, 2**31 - 1) for i in range(iters)]
+
+
+# Each process pool worker keeps its own Sim, built by _init_worker.
+_worker_sim = None
+
+def _init_worker(config):
+    """Process pool initializer: re-import the agent classes in this worker
+    and build the Sim that _run_iteration will use."""
+    global _worker_sim
+    config.add("agent_classes", load_modules(config.agent_class_names))
+    _worker_sim = Sim(config)
+
+def _run_iteration(seed):
+    return _worker_sim.run_iteration(seed)
+
 
 class Sim:
-    def __init__(self, config):
+    def __init__(self, config, timer=None):
+        """timer: a timing.PhaseTimer to time the round loop's phases."""
         self.config = config
         self.up_bws_state = dict()
+        self.timer = timer or NullTimer()
 
     
     def up_bw(self, peer_id, reinit=False):
@@ -35,131 +67,115 @@ class Sim:
         s = self.up_bws_state
 
         # Re-initialize up-bws if we are starting a new simulation
-        if reinit and peer_id in s:
-            del s[peer_id]
-        
-        """Sets the upload bandwidth of seeds to max, other agents at random"""
-        if re.match("Seed",peer_id): the_up_bw = c.max_up_bw
-        else: the_up_bw = random.randint(c.min_up_bw, c.max_up_bw)
-        
-        return s.setdefault(peer_id, the_up_bw)
-
-    def run_sim_once(self):
-        """Return a history"""
+        if reinit or peer_id not in s:
+            # Seeds upload at the max, other agents at random
+            if peer_id.startswith("Seed"):
+                s[peer_id] = c.max_up_bw
+            else:
+                s[peer_id] = self.rng.randint(c.min_up_bw, c.max_up_bw)
+        return s[peer_id]
+
+    def run_sim_once(self, seed=None):
+        """
+        Return a history.
+
+        seed: seeds the sim's own random stream, which draws the upload
+        bandwidths and one random.Random stream per peer (Peer.rng).
+        Default: drawn from the global random module.
+        """
         conf = self.config
+        if seed is None:
+            seed = random.randint(0, 2**31 - 1)
+        self.rng = random.Random(seed)
+        timer = self.timer
         # Keep track of the current round.  Needs to be in scope for helpers.
         round = 0  
 
-        def check_pred(pred, msg, Exc, lst):
-            """Check if any element of lst matches the predicate.  If it does,
-            raise an exception of type Exc, including the msg and the offending
-            element."""
-            m = map(pred, lst)
-            if True in m:
-                i = m.index(True)
-                raise Exc(msg + " Bad element: %s" % lst[i])
-
-        def check_uploads(peer, uploads):
-            """Raise an IllegalUpload exception if there is a problem."""
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalUpload, uploads)
-
-            not_upload = lambda o: not isinstance(o, Upload)
-            check(not_upload, "List of Uploads contains non-Upload object.")
-
-            self_upload = lambda upload: upload.to_id == peer.id
-            check(self_upload, "Can't upload to yourself.")
-            
-            not_from_self = lambda upload: upload.from_id != peer.id
-            check(not_from_self, "Upload.from != peer id.")
-
-            check(lambda u: u.bw < 0, "Upload bandwidth must be non-negative!")
+        def check_uploads(i, peer, uploads):
+            """Raise an IllegalUpload exception if there is a problem.
+            Every rule is checked for each upload in a single pass."""
+            total = 0
+            for u in uploads:
+                if not isinstance(u, Upload):
+                    msg = "List of Uploads contains non-Upload object."
+                elif u.to_id == peer.id:
+                    msg = "Can't upload to yourself."
+                elif u.from_id != peer.id:
+                    msg = "Upload.from != peer id."
+                elif u.bw < 0:
+                    msg = "Upload bandwidth must be non-negative!"
+                else:
+                    total += u.bw
+                    continue
+                raise IllegalUpload(msg + " Bad element: %s" % u)
 
-            limit = self.up_bw(peer.id)
-            if sum(map(lambda u: u.bw, uploads)) > limit:
+            limit = up_bws[i]
+            if total > limit:
                 raise IllegalUpload("Can't upload more than limit of %d. %s" % (
                     limit, uploads))
 
             # If we got here, looks ok.
 
-        def check_requests(peer, requests, peer_pieces, available):
-            """Raise an IllegalRequest exception if there is a problem."""
-
-            def check(pred, msg):
-                check_pred(pred, msg, IllegalRequest, requests)
-
-            check(lambda o: not isinstance(o, Request),
-                  "List of Requests contains non-Request object.")
+        def check_requests(i, peer, requests, peer_pieces, available):
+            """Raise an IllegalRequest exception if there is a problem.
+            Every rule is checked for each request in a single pass."""
+            num_pieces = conf.num_pieces
+            bpp = conf.blocks_per_piece
+            ranges = conf.block_ranges
+            for r in requests:
+                if not isinstance(r, Request):
+                    msg = "List of Requests contains non-Request object."
+                elif r.piece_id < 0 or r.piece_id >= num_pieces:
+                    msg = "Request asks for non-existent piece!"
+                elif r.peer_id not in peer_index:
+                    msg = "Request mentions non-existent peer!"
+                elif neighbor_ids is not None and r.peer_id not in neighbor_ids[i]:
+                    msg = "Request mentions peer outside the neighborhood!"
+                elif r.requester_id != peer.id:
+                    msg = "Request has wrong peer id!"
+                elif r.piece_id not in available[peer_index[r.peer_id]]:
+                    msg = "Asking for piece peer does not have!"
+                elif ranges:
+                    # Any range of blocks within the piece
+                    if 0 <= r.start < (bpp if r.end is None else r.end) <= bpp:
+                        continue
+                    msg = "Request has bad block range!"
+                elif r.end is not None:
+                    msg = "Request has a block range without --block-ranges!"
+                elif (r.start < 0 or r.start >= bpp or
+                      r.start > peer_pieces.get(i, r.piece_id)):
+                    # Must request the _next_ necessary block
+                    msg = "Request has bad start block!"
+                else:
+                    continue
+                raise IllegalRequest(msg + " Bad element: %s" % r)
 
-            bad_piece_id = lambda r: (r.piece_id < 0 or
-                                      r.piece_id >= self.config.num_pieces)
-            check(bad_piece_id, "Request asks for non-existent piece!")
-            
-            bad_peer_id = lambda r: r.peer_id not in self.peer_ids
-            check(bad_peer_id, "Request mentions non-existent peer!")
-
-            bad_requester_id = lambda r: r.requester_id != peer.id
-            check(bad_requester_id, "Request has wrong peer id!")
-
-            bad_start_block = lambda r: (
-                r.start < 0 or
-                r.start >= self.config.blocks_per_piece or
-                r.start > peer_pieces[peer.id][r.piece_id])
-            # Must request the _next_ necessary block
-            check(bad_start_block, "Request has bad start block!")
-
-            def piece_peer_does_not_have(r):
-                other_peer = self.peers_by_id[r.peer_id]
-                return r.piece_id not in available[other_peer.id]
-            check(piece_peer_does_not_have, "Asking for piece peer does not have!")
-            
             # If we got here, looks ok
 
-        def available_pieces(peer_id, peer_pieces):
+        def available_pieces(i, peer_pieces):
             """
-            Return a list of piece ids that this peer has available.
+            Return a list of piece ids that peer i has available.
             """
-            return filter(lambda i: peer_pieces[peer_id][i] == conf.blocks_per_piece,
+            pieces = peer_pieces.pieces(i)
+            return filter(lambda i: pieces[i] == conf.blocks_per_piece,
                           range(conf.num_pieces))
 
-        def peer_done(peer_pieces, peer_id):
-            # TODO: remove linear pass
-            for blocks_so_far in peer_pieces[peer_id]:
-                if blocks_so_far < conf.blocks_per_piece:
-                    return False
-            return True
-            
         def all_done(peer_pieces):
-            result = True
-            # Check all peers to update done status
-            for peer_id in peer_pieces:
-                if peer_done(peer_pieces, peer_id):
-                    history.peer_is_done(round, peer_id)
-                else:
-                    result = False
-            return result
+            # Only the peers that finished since the last check need updating
+            for i in peer_pieces.pop_newly_done():
+                history.peer_is_done(round, ids[i])
+            return not peer_pieces.unfinished
 
         def create_peers():
             """Each agent class must be already loaded, and have a
-            constructor that takes the config, id,  pieces, and
-            up and down bandwidth, in that order."""
+            constructor that takes the config, id,  pieces,
+            up bandwidth and random stream, in that order."""
 
             def load(class_name, params):
                 agent_class = conf.agent_classes[class_name]
                 return agent_class(*params)
 
-            counts = dict()
-            def index(name):
-                if name in counts:
-                    a = counts[name]
-                    counts[name] += 1
-                else:
-                    a = 0
-                    counts[name] = 1
-                return a
-
-            n = len(conf.agent_class_names)
-            ids = map(lambda n: "%s%d" % (n,index(n)), conf.agent_class_names)
+            ids = make_peer_ids(conf.agent_class_names)
 
             is_seed = lambda id: id.startswith("Seed")
 
@@ -169,60 +185,107 @@ class Sim:
                 else:
                     return [0]*conf.num_pieces
                 
-            peer_pieces = dict()  # id -> list (blocks / piece)
-            peer_pieces = dict((id, get_pieces(id)) for id in ids)
             pieces = [get_pieces(id) for id in ids]
+            peer_pieces = PieceStore(conf.num_pieces, conf.blocks_per_piece,
+                                     pieces, conf.block_ranges)
             r = itertools.repeat
             
+            # Each peer draws from its own stream, so that one agent's
+            # random choices can't change another's
+            rngs = [random.Random(self.rng.getrandbits(64)) for id in ids]
+
             # Re-initialize upload bandwidths at the beginning of each
             # new simulation
             up_bws = [self.up_bw(id, reinit=True) for id in ids] 
-            params = zip(r(conf), ids, pieces, up_bws)
+            params = zip(r(conf), ids, pieces, up_bws, rngs)
 
             peers = map(load, conf.agent_class_names, params)
             #logging.debug("Peers: \n" + "\n".join(str(p) for p in peers))
-            return peers, peer_pieces
+            return peers, peer_pieces, up_bws
+
+        def call_agent(p, name, method, *args):
+            """
+            Call one of p's strategy methods.  With a time budget set, a
+            call that runs over it is logged and counted in the history,
+            and with budget_penalty its result is thrown away, as if the
+            peer had asked for or uploaded nothing.  Overruns can change
+            the results, so they are logged even with --quiet.
+            """
+            if budget is None:
+                return method(*args)
+            start = time.time()
+            result = method(*args)
+            elapsed = time.time() - start
+            if elapsed > budget:
+                history.peer_over_budget(p.id)
+                logging.warning("Round %d: %s.%s took %.1f ms, over the "
+                                "%g ms budget", round, p.id, name,
+                                elapsed * 1000, conf.time_budget)
+                if conf.budget_penalty:
+                    return []
+            return result
 
-        def get_peer_requests(p, peer_info, peer_history, peer_pieces, available):
-            def remove_me(info):
-                # TODO: Do we need this linear pass?
-                return filter(lambda peer: peer.id != p.id, peer_info)
+        def visible(i, peer_info):
+            """The PeerInfo peer i gets to see: every other peer, or only
+            its neighbors when the swarm has neighborhoods."""
+            if neighbors is None:
+                return AllBut(peer_info, i)
+            return [peer_info[j] for j in neighbors[i]]
 
-            pieces = copy.copy(peer_pieces[p.id])
+        def get_peer_requests(i, p, peer_info, peer_history, peer_pieces,
+                              available, rarity):
+
+            pieces = peer_pieces.pieces(i)
             # Made copy of pieces and the peer info this peer needs to make it's
             # decision, so that it can't change the simulation's copies.
             p.update_pieces(pieces)
-            rs = p.requests(remove_me(peer_info), peer_history)
-            check_requests(p, rs, peer_pieces, available)
+            p.update_rarity(rarity)
+            t = timer.now()
+            rs = call_agent(p, "requests", p.requests,
+                            visible(i, peer_info), peer_history)
+            timer.add("requests", t, p)
+            if not trusted[i]:
+                t = timer.now()
+                check_requests(i, p, rs, peer_pieces, available)
+                timer.add("validation", t, p)
             return rs
 
-        def get_peer_uploads(all_requests, p, peer_info, peer_history):
-            def remove_me(info):
-                # TODO: remove this pass?  Use a set?
-                return filter(lambda peer: peer.id != p.id, peer_info)
-
-            def requests_to(id):
-                f = lambda r: r.peer_id == id
-                ans = []
-                for rs in all_requests.values():
-                    ans.extend(filter(f, rs))
-                return ans
-
-            requests = requests_to(p.id)
-
-            us = p.uploads(requests, remove_me(peer_info), peer_history)
-            check_uploads(p, us)
+        def route_requests(all_requests):
+            """
+            Bucket this round's requests by the peer they are addressed to,
+            in one pass.  Returns [[requests to peer i]]
+            """
+            inbox = [[] for p in peers]
+            for rs in all_requests:
+                for r in rs:
+                    inbox[peer_index[r.peer_id]].append(r)
+            return inbox
+
+        def get_peer_uploads(i, requests, p, peer_info, peer_history):
+            t = timer.now()
+            us = call_agent(p, "uploads", p.uploads,
+                            requests, visible(i, peer_info), peer_history)
+            timer.add("uploads", t, p)
+            if not trusted[i]:
+                t = timer.now()
+                check_uploads(i, p, us)
+                timer.add("validation", t, p)
             return us
 
-        def upload_rate(uploads, uploader_id, requester_id):
+        def upload_rates(uploads):
             """
-            return the uploading rate from uploader to requester
-            in blocks per time period, or 0 if not uploading.
+            Returns [dict : requester index -> bw], the rate each peer
+            uploads to each requester in blocks per time period, for O(1)
+            lookups.  If an agent lists the same requester twice, the first
+            upload counts.
             """
-            for u in uploads[uploader_id]:
-                if u.to_id == requester_id:
-                    return u.bw
-            return 0
+            rates = []
+            for us in uploads:
+                to = dict()
+                for u in us:
+                    to.setdefault(peer_index.get(u.to_id), u.bw)
+                rates.append(to)
+            return rates
 
         def update_peer_pieces(peer_pieces, requests, uploads, available):
             """
@@ -231,167 +294,332 @@ class Sim:
             Make sure requesting the same thing from lots of peers doesn't
             stack.
             update the sets of available pieces as needed.
+
+            The new blocks are buffered in peer_pieces and applied in place
+            once every requester has been processed.
+
+            Returns [[(from index, piece, blocks)]], the downloads to each peer.
             """
-            downloads = dict()  # peer_id -> [downloads]
-            new_pp = copy.deepcopy(peer_pieces)
-            for requester_id in requests:
-                downloads[requester_id] = list()
-            for requester_id in requests:
+            rates = upload_rates(uploads)
+            downloads = [[] for p in peers]
+            get_peer_id = lambda r: r.peer_id
+            for i in range(len(peers)):
+                if conf.block_ranges:
+                    downloads[i] = ranged_downloads(i, requests[i], peer_pieces,
+                                                    rates)
+                    continue
                 # Keep track of how many blocks of each piece this
                 # requester got.  piece -> (blocks, from_who)
                 new_blocks_per_piece = dict()
-                def update_count(piece_id, blocks, peer_id):
+                def update_count(piece_id, blocks, j):
                     if piece_id in new_blocks_per_piece:
                         old = new_blocks_per_piece[piece_id][0]
                         if blocks > old:
-                            new_blocks_per_piece[piece_id] = (blocks, peer_id)
+                            new_blocks_per_piece[piece_id] = (blocks, j)
                     else:
-                        new_blocks_per_piece[piece_id] = (blocks, peer_id)
+                        new_blocks_per_piece[piece_id] = (blocks, j)
 
                 # Group the requests by peer that is being asked
-                get_peer_id = lambda r: r.peer_id
-                rs = sorted(requests[requester_id], key=get_peer_id)
+                rs = sorted(requests[i], key=get_peer_id)
                 for peer_id, rs_for_peer in itertools.groupby(rs, get_peer_id):
-                    bw = upload_rate(uploads, peer_id, requester_id)
+                    j = peer_index[peer_id]
+                    bw = rates[j].get(i, 0)
                     if bw == 0:
                         continue
                     # This bandwidth gets applied in order to each piece requested
                     for r in rs_for_peer:
                         needed_blocks = conf.blocks_per_piece - r.start
                         alloced_bw = min(bw, needed_blocks)
-                        update_count(r.piece_id, alloced_bw, peer_id)
+                        update_count(r.piece_id, alloced_bw, j)
                         bw -= alloced_bw
                         if bw == 0:
                             break
                 for piece_id in new_blocks_per_piece:
-                    (blocks, peer_id) = new_blocks_per_piece[piece_id]
-                    new_pp[requester_id][piece_id] += blocks
-                    if new_pp[requester_id][piece_id] == conf.blocks_per_piece:
-                        available[requester_id].add(piece_id)
-                    d = Download(peer_id, requester_id, piece_id, blocks)
-                    downloads[requester_id].append(d)
-                
-            return (new_pp, downloads)
-
-        def completed_pieces(peer_id, available):
-            return len(available[peer_id])
-        
-        def log_peer_info(peer_pieces, available):
-            for p_id in self.peer_ids:
-                pieces = peer_pieces[p_id]
-                logging.debug("pieces for %s: %s" % (str(p_id), str(pieces)))
-            log = ", ".join("%s:%s" % (p_id, completed_pieces(p_id, available))
-                            for p_id in self.peer_ids)
-            logging.info("Pieces completed: " + log)
+                    (blocks, j) = new_blocks_per_piece[piece_id]
+                    peer_pieces.add(i, piece_id, blocks)
+                    downloads[i].append((j, piece_id, blocks))
 
+            for (i, piece_id) in peer_pieces.apply():
+                available[i] = available[i].with_piece(piece_id)
+                rarity.add(piece_id)
 
-        logging.debug("Starting simulation with config: %s" % str(conf))
+            return downloads
 
-        peers, peer_pieces = create_peers()
-        self.peer_ids = [p.id for p in peers]
-        self.peers_by_id = dict((p.id, p) for p in peers)
+        def ranged_downloads(i, rs, peer_pieces, rates):
+            """
+            With --block-ranges: each uploader sends, in request order, the
+            blocks of each requested range that requester i doesn't have
+            yet, one block per whole unit of bandwidth.  Every block counts,
+            whichever uploader sent it, so several uploaders can fill
+            disjoint ranges of one piece in the same round.  A block sent by
+            more than one of them is credited to the first, by peer id.
+
+            The blocks are buffered in peer_pieces.  Returns the requester's
+            list of (from index, piece, blocks) downloads.
+            """
+            bpp = conf.blocks_per_piece
+            got = dict()  # piece_id -> bitmap of blocks received this round
+            downloads = []
+            get_peer_id = lambda r: r.peer_id
+            rs = sorted(rs, key=get_peer_id)
+            for peer_id, rs_for_peer in itertools.groupby(rs, get_peer_id):
+                j = peer_index[peer_id]
+                bw = int(rates[j].get(i, 0))
+                if bw == 0:
+                    continue
+                sent = dict()  # piece_id -> bitmap of blocks this peer sent
+                for r in rs_for_peer:
+                    end = bpp if r.end is None else r.end
+                    wanted = ((1 << end) - (1 << r.start)) & ~sent.get(r.piece_id, 0)
+                    wanted &= ~peer_pieces.block_map(i, r.piece_id)
+                    while wanted and bw > 0:
+                        low = wanted & -wanted
+                        sent[r.piece_id] = sent.get(r.piece_id, 0) | low
+                        wanted ^= low
+                        bw -= 1
+                    if bw == 0:
+                        break
+                for (piece_id, bitmap) in sorted(sent.items()):
+                    new = bitmap & ~got.get(piece_id, 0)
+                    if new:
+                        got[piece_id] = got.get(piece_id, 0) | new
+                        downloads.append((j, piece_id, bin(new).count("1")))
+            for (piece_id, bitmap) in got.items():
+                peer_pieces.add_blocks(i, piece_id, bitmap)
+            return downloads
+
+        def completed_pieces(i, available):
+            return len(available[i])
         
-        upload_rates = dict((id, self.up_bw(id)) for id in self.peer_ids)
-        history = History(self.peer_ids, upload_rates)
-
-        # dict : pid -> set(finished / available pieces)
-        available = dict((pid, set(available_pieces(pid, peer_pieces)))
-                         for pid in self.peer_ids)
+        def log_peer_info(peer_pieces, available):
+            if debug:
+                for (i, p_id) in enumerate(ids):
+                    pieces = peer_pieces.pieces(i)
+                    logging.debug("pieces for %s: %s", p_id, pieces)
+            if info:
+                log = ", ".join("%s:%s" % (p_id, completed_pieces(i, available))
+                                for (i, p_id) in enumerate(ids))
+                logging.info("Pieces completed: " + log)
+
+        # Work out once whether anything per-round will be logged, so that
+        # nothing gets formatted when it won't be.  --quiet turns it all off.
+        root_logger = logging.getLogger('')
+        debug = not conf.quiet and root_logger.isEnabledFor(logging.DEBUG)
+        info = not conf.quiet and root_logger.isEnabledFor(logging.INFO)
+
+        if debug:
+            logging.debug("Starting simulation with config: %s", conf)
+
+        # Per-call time budget for agents, in seconds, or None
+        budget = conf.time_budget / 1000.0 if conf.time_budget is not None else None
+
+        # Inside the round loop peers are referred to by their index in
+        # peers (and ids), and per-peer state is kept in lists indexed by it.
+        # The string ids are only used in what agents see and in reporting.
+        peers, peer_pieces, up_bws = create_peers()
+        self.peer_ids = ids = [p.id for p in peers]
+        peer_index = dict((pid, i) for (i, pid) in enumerate(ids))
+        # Whether each peer's output goes unvalidated
+        trusted = [conf.trust_agents and p.__class__.__name__ in TRUSTED_AGENTS
+                   for p in peers]
+        
+        history = History(ids, dict(zip(ids, up_bws)), conf.history_rounds)
+
+        # peer index -> PieceSet(finished / available pieces)
+        available = [PieceSet.from_ids(available_pieces(i, peer_pieces))
+                     for i in range(len(peers))]
+
+        # With conf.neighbors set, each peer only sees and trades with its
+        # neighbors.  neighbors: peer index -> [neighbor indices], and
+        # neighbor_ids: peer index -> set(neighbor ids), for validation.
+        neighbors = None
+        neighbor_ids = None
+        if conf.neighbors is not None:
+            neighbor_rng = random.Random(self.rng.getrandbits(64))
+
+        def refresh_neighborhoods():
+            ns = sample_neighborhoods(neighbor_rng, len(peers), conf.neighbors)
+            return (ns, [set(ids[j] for j in n) for n in ns])
+
+        # How many peers have each piece, kept up to date as pieces are
+        # completed, and shared read-only with all agents
+        rarity = RarityIndex(piece_counts(conf.num_pieces, available))
+        rarity_view = RarityView(rarity)
+
+        # Last round's rarity changes, requests and downloads, for --skip-idle
+        changes = None
+        requests = []
+        downloads = []
 
         # Begin the event loop
         while True:
-            logging.info("======= Round %d ========" % round)
-
-            peer_info = [PeerInfo(p.id, available[p.id])
-                         for p in peers]
-            requests = dict()  # peer_id -> list of Requests
-            uploads = dict()   # peer_id -> list of Uploads
-            h = dict()
-            for p in peers:
-                h[p.id] = history.peer_history(p.id)
-                requests[p.id] = get_peer_requests(p, peer_info, h[p.id], peer_pieces,
-                                                   available)
-
-            for p in peers:
-                uploads[p.id] = get_peer_uploads(requests, p, peer_info, h[p.id])
-                
-
-            (peer_pieces, downloads) = update_peer_pieces(
+            if info:
+                logging.info("======= Round %d ========", round)
+
+            # If no piece was completed last round then nobody's available
+            # pieces have changed.
+            last_changes = changes
+            changes = rarity.changes
+            idle = conf.skip_idle and changes == last_changes
+            if conf.neighbors is not None and round % conf.neighbor_refresh == 0:
+                (neighbors, neighbor_ids) = refresh_neighborhoods()
+                idle = False
+            if not idle:
+                # One shared, read-only snapshot for all agents
+                peer_info = tuple(PeerInfo(p.id, available[i])
+                                  for (i, p) in enumerate(peers))
+            last_requests = requests
+            requests = []  # peer index -> list of Requests
+            uploads = []   # peer index -> list of Uploads
+            h = []
+            for (i, p) in enumerate(peers):
+                h.append(history.peer_history(p.id))
+                if idle and p.idle_requests and not downloads[i]:
+                    # Nothing requests() looks at has changed
+                    requests.append(last_requests[i])
+                    continue
+                requests.append(get_peer_requests(i, p, peer_info, h[i], peer_pieces,
+                                                  available, rarity_view))
+
+            t = timer.now()
+            inbox = route_requests(requests)
+            timer.add("routing", t)
+            for (i, p) in enumerate(peers):
+                if conf.skip_idle and p.idle_uploads and not inbox[i]:
+                    uploads.append([])
+                    continue
+                uploads.append(get_peer_uploads(i, inbox[i], p, peer_info, h[i]))
+
+
+            t = timer.now()
+            downloads = update_peer_pieces(
                 peer_pieces, requests, uploads, available)
+            timer.add("piece update", t)
+            t = timer.now()
             history.update(downloads, uploads)
+            timer.add("history", t)
+            timer.end_round()
 
-            logging.debug(history.pretty_for_round(round))
+            if debug:
+                logging.debug(history.pretty_for_round(round))
 
             log_peer_info(peer_pieces, available)
            
             if all_done(peer_pieces):
-                logging.info("All done!")                    
+                if info:
+                    logging.info("All done!")
                 break
             round += 1
             if round > conf.max_round:
-                logging.info("Out of time.  Stopping.")
+                if info:
+                    logging.info("Out of time.  Stopping.")
                 break
 
-        logging.info("Game history:\n%s" % history.pretty())
+        if info:
+            logging.info("Game history:\n%s", history.pretty())
 
-        logging.info("======== STATS ========")
-        logging.info("Uploaded blocks:\n%s" %
-                     Stats.uploaded_blocks_str(self.peer_ids, history))
-        logging.info("Completion rounds:\n%s" %
-                     Stats.completion_rounds_str(self.peer_ids, history))
-        logging.info("All done round: %s" %
-                     Stats.all_done_round(self.peer_ids, history))
+            logging.info("======== STATS ========")
+            logging.info("Uploaded blocks:\n%s",
+                         Stats.uploaded_blocks_str(self.peer_ids, history))
+            logging.info("Completion rounds:\n%s",
+                         Stats.completion_rounds_str(self.peer_ids, history))
+            logging.info("All done round: %s",
+                         Stats.all_done_round(self.peer_ids, history))
 
         return history
 
-    def run_sim(self):
-        histories = map(lambda i: self.run_sim_once(), 
-                        range(self.config.iters))
-        logging.warning("======== SUMMARY STATS ========")
-        
-        uploaded_blocks = map(
-            lambda h: Stats.uploaded_blocks(self.peer_ids, h),
-            histories)
-        completion_rounds = map(
-            lambda h: Stats.completion_rounds(self.peer_ids, h),
-            histories)
-
-        def extract_by_peer_id(lst, peer_id):
-            """Given a list of dicts, pull out the entry
-            for peer_id from each dict.  Return a list"""
-            return map(lambda d: d[peer_id], lst)
-
-        uploaded_by_id = dict(
-            (p_id, extract_by_peer_id(uploaded_blocks, p_id))
-            for p_id in self.peer_ids)
-
-        completion_by_id = dict(
-            (p_id, extract_by_peer_id(completion_rounds, p_id))
-            for p_id in self.peer_ids)
-
+    def run_iteration(self, seed):
+        """Run one seeded simulation.  Returns the per-peer summary stats
+        (uploaded blocks, completion rounds, time budget overruns) rather
+        than the whole history, so that results are cheap to send back from
+        a worker process, and the iteration's PhaseTimer if timing is on
+        (else None)."""
+        conf = self.config
+        random.seed(seed)
+        if conf.engine == "vector":
+            return VectorSim(conf, seed).run() + (dict(), None)
+        if conf.timing:
+            self.timer = PhaseTimer(trace=conf.trace is not None)
+        history = self.run_sim_once(seed)
+        if conf.save_history:
+            history.save(conf.save_history.format(seed=seed))
+        return (Stats.uploaded_blocks(self.peer_ids, history),
+                Stats.completion_rounds(self.peer_ids, history),
+                Stats.budget_overruns(self.peer_ids, history),
+                self.timer if conf.timing else None)
+
+    def log_timing(self, timer):
+        """Log per-agent-class call time percentiles across iterations."""
+        logging.warning("Agent call times (ms): calls p50 p90 p99 max")
+        for (cls, phase, n, (p50, p90, p99), top) in timer.agent_percentiles():
+            logging.warning("%s %s: %d  %.3f %.3f %.3f %.3f" % (
+                cls, phase, n, p50 * 1000, p90 * 1000, p99 * 1000, top * 1000))
+        logging.warning("Phase totals (s): " + ", ".join(
+            "%s %.3f" % (phase, timer.totals[phase]) for phase in PHASES))
+
+    def log_summary(self, summary):
+        """Log a RunSummary: per-peer averages over the iterations so far."""
+        conf = self.config
         logging.warning("Uploaded blocks: avg (stddev)")
         for p_id in sorted(self.peer_ids,
-                           key=lambda id: mean(uploaded_by_id[id])):
-            us = uploaded_by_id[p_id]
-            logging.warning("%s: %.1f  (%.1f)" % (p_id, mean(us), stddev(us)))
+                           key=lambda id: summary.uploaded[id].mean):
+            us = summary.uploaded[p_id]
+            logging.warning("%s: %.1f  (%.1f)" % (p_id, us.mean, us.stddev()))
 
         logging.warning("Completion rounds: avg (stddev)")
+        for p_id in sorted(self.peer_ids, key=summary.completion_mean):
+            logging.warning("%s: %s  (%s)" % (p_id, summary.completion_mean(p_id),
+                                              summary.completion_stddev(p_id)))
 
-        def optionize(f):
-            def g(lst):
-                if None in lst:
-                    return None
-                else:
-                    return f(lst)
-            return g
+        if conf.time_budget is not None:
+            logging.warning("Calls over the %g ms time budget: total" %
+                            conf.time_budget)
+            for p_id in self.peer_ids:
+                if summary.overruns[p_id]:
+                    logging.warning("%s: %d" % (p_id, summary.overruns[p_id]))
 
-        opt_mean = optionize(mean)
-        opt_stddev = optionize(stddev)
-        
-        for p_id in sorted(self.peer_ids,
-                           key=lambda id: opt_mean(completion_by_id[id])):
-            cs = completion_by_id[p_id]
-            logging.warning("%s: %s  (%s)" % (p_id, opt_mean(cs), opt_stddev(cs)))
+    def run_sim(self):
+        conf = self.config
+        seeds = iteration_seeds(conf.seed, conf.iters)
+        self.peer_ids = make_peer_ids(conf.agent_class_names)
+
+        # Each iteration's results are folded into these as it finishes
+        summary = RunSummary(self.peer_ids)
+        timer = PhaseTimer()
+        traced = []  # the timers themselves, only kept for --trace
+
+        pool = None
+        if conf.workers > 1:
+            pool = multiprocessing.Pool(conf.workers, _init_worker, (conf,))
+            # imap keeps iteration order, so the merged stats match a
+            # serial run with the same master seed.
+            results = pool.imap(_run_iteration, seeds, 1)
+        else:
+            results = itertools.imap(self.run_iteration, seeds)
+        try:
+            for (u, c, o, t) in results:
+                summary.add(u, c, o)
+                if t is not None:
+                    timer.merge(t)
+                    if conf.trace:
+                        traced.append(t)
+                if (conf.summary_every and summary.iterations < conf.iters and
+                        summary.iterations % conf.summary_every == 0):
+                    logging.warning("======== SUMMARY AFTER %d ITERATIONS ========",
+                                    summary.iterations)
+                    self.log_summary(summary)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        logging.warning("======== SUMMARY STATS ========")
+        self.log_summary(summary)
+
+        if timer.rounds:
+            self.log_timing(timer)
+            if conf.trace:
+                write_trace(conf.trace, traced)
 
 
 
@@ -429,9 +657,47 @@ def parse_agents(args):
             
         
 
+def default_config(agents=None):
+    """
+    A Params with every setting at its default, the same defaults as the
+    command line options', for running agents, a list of agent class
+    names (default: two Dummies and a Seed).  bench.py and sweep.py build
+    their configs from this too.
+    """
+    if agents is None:
+        agents = ['Dummy', 'Dummy', 'Seed']
+    config = Params()
+    config.add("agent_class_names", agents)
+    config.add("agent_classes", load_modules(agents))
+    config.add("num_pieces", 3)
+    config.add("blocks_per_piece", 4)
+    config.add("max_round", 5)
+    config.add("min_up_bw", 4)
+    config.add("max_up_bw", 10)
+    config.add("iters", 1)
+    config.add("quiet", False)
+    config.add("summary_every", None)
+    config.add("history_rounds", None)
+    config.add("save_history", None)
+    config.add("workers", 1)
+    config.add("engine", "python")
+    config.add("neighbors", None)
+    config.add("neighbor_refresh", 10)
+    config.add("skip_idle", False)
+    config.add("trust_agents", False)
+    config.add("block_ranges", False)
+    config.add("time_budget", None)
+    config.add("budget_penalty", False)
+    config.add("timing", False)
+    config.add("trace", None)
+    config.add("seed", None)
+    return config
+
+
 def main(args):
     usage_msg = "Usage:  %prog [options] PeerClass1[,count] PeerClass2[,count] ..."
     parser = OptionParser(usage=usage_msg)
+    defaults = default_config([])
 
     def usage(msg):
         print "Error: %s\n" % msg
@@ -442,65 +708,181 @@ def main(args):
                       dest="loglevel", default="info",
                       help="Set the logging level: 'debug' or 'info'")
 
+    parser.add_option("--quiet",
+                      dest="quiet", action="store_true", default=defaults.quiet,
+                      help="Skip all per-round logging, whatever the log level, "
+                      "except --time-budget overruns")
+
     parser.add_option("--num-pieces",
-                      dest="num_pieces", default=3, type="int",
+                      dest="num_pieces", default=defaults.num_pieces, type="int",
                       help="Set number of pieces in the file")
 
     parser.add_option("--blocks-per-piece",
-                      dest="blocks_per_piece", default=4, type="int",
+                      dest="blocks_per_piece", default=defaults.blocks_per_piece, type="int",
                       help="Set number of blocks per piece")
 
     parser.add_option("--max-round",
-                      dest="max_round", default=5, type="int",
+                      dest="max_round", default=defaults.max_round, type="int",
                       help="Limit on number of rounds")
 
     parser.add_option("--min-bw",
-                      dest="min_up_bw", default=4, type="int",
+                      dest="min_up_bw", default=defaults.min_up_bw, type="int",
                       help="Min upload bandwidth")
 
     parser.add_option("--max-bw",
-                      dest="max_up_bw", default=10, type="int",
+                      dest="max_up_bw", default=defaults.max_up_bw, type="int",
                       help="Max upload bandwidth")
 
     parser.add_option("--iters",
-                      dest="iters", default=1, type="int",
+                      dest="iters", default=defaults.iters, type="int",
                       help="Number of times to run simulation to get stats")
 
+    parser.add_option("--summary-every",
+                      dest="summary_every", default=defaults.summary_every, type="int",
+                      help="Also log the summary so far every this many iterations")
+
+    parser.add_option("--history-rounds",
+                      dest="history_rounds", default=defaults.history_rounds, type="int",
+                      help="Only keep this many recent rounds of history (default: all)")
+
+    parser.add_option("--save-history",
+                      dest="save_history", default=defaults.save_history,
+                      help="Save each run's history in binary form to this file; "
+                      "'{seed}' in the name is replaced by the run's seed")
+
+    parser.add_option("--profile",
+                      dest="profile", default=None,
+                      help="Run under cProfile and write the stats to this file")
+
+    parser.add_option("--time-budget",
+                      dest="time_budget", default=defaults.time_budget, type="float",
+                      help="Per-call wall time budget in ms for agents' "
+                      "requests() and uploads(); overruns are logged and counted")
+
+    parser.add_option("--budget-penalty",
+                      dest="budget_penalty", action="store_true", default=defaults.budget_penalty,
+                      help="Discard the result of a call that runs over "
+                      "--time-budget, as if it returned []")
+
+    parser.add_option("--neighbors",
+                      dest="neighbors", default=defaults.neighbors, type="int",
+                      help="Give each peer this many random neighbors (plus "
+                      "those that picked it) instead of the whole swarm")
+
+    parser.add_option("--neighbor-refresh",
+                      dest="neighbor_refresh", default=defaults.neighbor_refresh, type="int",
+                      help="With --neighbors, draw new neighborhoods every "
+                      "this many rounds")
+
+    parser.add_option("--skip-idle",
+                      dest="skip_idle", action="store_true", default=defaults.skip_idle,
+                      help="Don't call agents whose decisions can't have "
+                      "changed (see Peer.idle_requests and Peer.idle_uploads)")
+
+    parser.add_option("--trust-agents",
+                      dest="trust_agents", action="store_true", default=defaults.trust_agents,
+                      help="Skip validating the requests and uploads of the "
+                      "shipped agents")
+
+    parser.add_option("--block-ranges",
+                      dest="block_ranges", action="store_true", default=defaults.block_ranges,
+                      help="Let requests name any range of blocks in a piece, "
+                      "so several peers can upload parts of it in one round")
+
+    parser.add_option("--timing",
+                      dest="timing", action="store_true", default=defaults.timing,
+                      help="Time each agent's calls and report percentiles "
+                      "per agent class")
+
+    parser.add_option("--trace",
+                      dest="trace", default=defaults.trace,
+                      help="Write a Chrome trace of every timed call to "
+                      "this file (implies --timing)")
+
+    parser.add_option("--workers",
+                      dest="workers", default=defaults.workers, type="int",
+                      help="Number of worker processes to spread iterations across")
+
+    parser.add_option("--engine",
+                      dest="engine", default=defaults.engine,
+                      choices=["python", "vector"],
+                      help="Round engine: 'python' or 'vector' (needs numpy)")
+
+    parser.add_option("--seed",
+                      dest="seed", default=defaults.seed, type="int",
+                      help="Master random seed (default: pick one at random)")
+
 
     (options, args) = parser.parse_args()
 
     # leftover args are class names, with optional counts:
     # "Peer Seed[,4]"
 
-    if len(args) == 0:
-        # default
-        agents_to_run = ['Dummy', 'Dummy', 'Seed']
-    else:
+    agents_to_run = None  # default
+    if len(args) > 0:
         try:
             agents_to_run = parse_agents(args)
         except ValueError, e:
             usage(e)
     
     configure_logging(options.loglevel)
-    config = Params()
-
-    config.add("agent_class_names", agents_to_run)
-    config.add("agent_classes", load_modules(config.agent_class_names))
+    config = default_config(agents_to_run)
 
-    
     config.add("num_pieces", options.num_pieces)
     config.add("blocks_per_piece",options.blocks_per_piece)
     config.add("max_round", options.max_round)
     config.add("min_up_bw", options.min_up_bw)
     config.add("max_up_bw", options.max_up_bw)
     config.add("iters", options.iters)
-    
+    config.add("quiet", options.quiet)
+    config.add("summary_every", options.summary_every)
+    config.add("history_rounds", options.history_rounds)
+    config.add("save_history", options.save_history)
+    config.add("workers", max(1, options.workers))
+    config.add("engine", options.engine)
+    config.add("neighbors", options.neighbors)
+    config.add("neighbor_refresh", max(1, options.neighbor_refresh))
+    config.add("skip_idle", options.skip_idle)
+    config.add("trust_agents", options.trust_agents)
+    config.add("block_ranges", options.block_ranges)
+    config.add("time_budget", options.time_budget)
+    config.add("budget_penalty", options.budget_penalty)
+    config.add("timing", options.timing or options.trace is not None)
+    config.add("trace", options.trace)
+    if config.engine == "vector":
+        # The vector engine has none of these, so a run would finish
+        # without the files they ask for
+        if config.save_history:
+            usage("--save-history needs the python engine")
+        if config.trace:
+            usage("--trace needs the python engine")
+        ignored = [("--timing", config.timing),
+                   ("--neighbors", config.neighbors is not None),
+                   ("--block-ranges", config.block_ranges),
+                   ("--history-rounds", config.history_rounds is not None),
+                   ("--time-budget", config.time_budget is not None),
+                   ("--budget-penalty", config.budget_penalty),
+                   ("--skip-idle", config.skip_idle),
+                   ("--trust-agents", config.trust_agents)]
+        for (option, given) in ignored:
+            if given:
+                logging.warning("%s only applies to the python engine; "
+                                "ignoring it" % option)
+        # The agents check it too, so it has to be off for them as well
+        config.add("block_ranges", False)
+
+    seed = options.seed
+    if seed is None:
+        seed = random.randint(0, 2**31 - 1)
+    logging.warning("Master seed: %d" % seed)
+    config.add("seed", seed)
+
     sim = Sim(config)
-    sim.run_sim()
+    if options.profile:
+        import cProfile
+        cProfile.runctx('sim.run_sim()', globals(), locals(), options.profile)
+    else:
+        sim.run_sim()
 
 if __name__ == "__main__":
-
-    # The next two lines are for profiling...
-    import cProfile
-    cProfile.run('main(sys.argv)', 'out.prof')
-#    main(sys.argv)
+    main(sys.argv)
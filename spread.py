@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+from pieces import PieceSet
+
+
+def spread_requests(peers, needed, pick, max_requests, endgame=False):
+    """
+    Decide which pieces to ask each peer for, spreading them across the
+    uploaders.
+
+    Two uploaders sending us the same piece in one round only counts once,
+    so each peer is first asked for pieces nobody else is being asked for
+    this round, and only then for ones that are.  An uploader spends its
+    bandwidth on the requests in order, so the repeats only get what is
+    left over.  Peers with the fewest pieces we want go first, so the
+    peers with more to offer are left the pieces the others don't have.
+
+    In the endgame every peer is asked for every needed piece it has, but
+    each starts at a different piece, so the ones that unchoke us send
+    different pieces first.
+
+    peers: PeerInfo objects
+    needed: PieceSet of the pieces we still need
+    pick(pieces, k): up to k piece ids from the PieceSet pieces, in the
+        order to ask for them, e.g. RarityView.rarest
+    max_requests: pieces to ask each peer for, outside the endgame
+
+    returns: [(peer, [piece ids])]
+    """
+    candidates = [(needed & peer.available_pieces, peer) for peer in peers]
+    candidates.sort(key=lambda c: len(c[0]))
+
+    asked = []
+    assigned = PieceSet()  # pieces already asked of an earlier peer
+    for (i, (needed_and_available, peer)) in enumerate(candidates):
+        if endgame:
+            ranked = pick(needed_and_available, len(needed_and_available))
+            k = i % len(ranked) if ranked else 0
+            piece_ids = ranked[k:] + ranked[:k]
+        else:
+            fresh = needed_and_available - assigned
+            piece_ids = []
+            if fresh:
+                piece_ids = pick(fresh, max_requests)
+                assigned = assigned | PieceSet.from_ids(piece_ids)
+            if len(piece_ids) < max_requests and fresh != needed_and_available:
+                piece_ids += pick(needed_and_available - fresh,
+                                  max_requests - len(piece_ids))
+        asked.append((peer, piece_ids))
+    return asked
@@ -1,5 +1,7 @@
 #!/usr/bin/python
 
+import math
+
 
 class Stats:
     @staticmethod
@@ -12,10 +14,11 @@ class Stats:
         dict: peer_id -> total upload blocks used
         """
         uploaded = dict((peer_id, 0) for peer_id in peer_ids)
+        # history keeps running per-sender totals, which also cover any
+        # rounds it no longer retains
         for peer_id in peer_ids:
-            for ds in history.downloads[peer_id]:
-                for download in ds:
-                    uploaded[download.from_id] += download.blocks
+            for (from_id, blocks) in history.received[peer_id].items():
+                uploaded[from_id] += blocks
 
         return uploaded
 
@@ -51,9 +54,74 @@ class Stats:
             "%s: %s" % (id, d[id]) for id in sorted(d.keys(), key=d.__getitem__)
         )
 
+    @staticmethod
+    def budget_overruns(peer_ids, history):
+        """Returns dict: peer_id -> number of agent calls that ran over
+        the time budget"""
+        return dict((id, history.overruns[id]) for id in peer_ids)
+
     @staticmethod
     def all_done_round(peer_ids, history):
         d = Stats.completion_rounds(peer_ids, history)
         if None in d.values():
             return None
         return max(d.values())
+
+
+class RunningStat:
+    """Running mean and (population) standard deviation, by Welford's method."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared differences from the mean
+
+    def add(self, x):
+        self.n += 1
+        d = x - self.mean
+        self.mean += d / float(self.n)
+        self.m2 += d * (x - self.mean)
+
+    def stddev(self):
+        if self.n == 0:
+            return 0
+        return math.sqrt(self.m2 / self.n)
+
+
+class RunSummary:
+    """
+    Per-peer aggregates over the iterations of a run, updated as each
+    iteration finishes, so memory doesn't grow with the number of
+    iterations and a partial summary is available at any point.
+    """
+
+    def __init__(self, peer_ids):
+        self.peer_ids = peer_ids
+        self.iterations = 0
+        self.uploaded = dict((pid, RunningStat()) for pid in peer_ids)
+        self.completion = dict((pid, RunningStat()) for pid in peer_ids)
+        self.unfinished = dict((pid, 0) for pid in peer_ids)
+        self.overruns = dict((pid, 0) for pid in peer_ids)
+
+    def add(self, uploaded, completion, overruns):
+        """Add one iteration's Stats.uploaded_blocks, completion_rounds and
+        budget_overruns."""
+        self.iterations += 1
+        for pid in self.peer_ids:
+            self.uploaded[pid].add(uploaded[pid])
+            if completion[pid] is None:
+                self.unfinished[pid] += 1
+            else:
+                self.completion[pid].add(completion[pid])
+            self.overruns[pid] += overruns.get(pid, 0)
+
+    def completion_mean(self, peer_id):
+        """None if the peer didn't finish in some iteration."""
+        if self.unfinished[peer_id]:
+            return None
+        return self.completion[peer_id].mean
+
+    def completion_stddev(self, peer_id):
+        if self.unfinished[peer_id]:
+            return None
+        return self.completion[peer_id].stddev()
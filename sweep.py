@@ -0,0 +1,219 @@
+#!/usr/bin/python
+
+"""
+Run the simulation over a grid of parameters, caching the results.
+
+  python sweep.py [--workers N] [--cache DIR] [--output FILE] GRID.json
+
+GRID.json gives a list of values for each parameter to sweep, or a single
+value to hold it fixed, e.g.
+
+  {"num_pieces": [20, 50], "blocks_per_piece": 4,
+   "min_up_bw": 4, "max_up_bw": [10, 16], "max_round": 500,
+   "agents": [["Seed,2", "KrankileStd,8"], ["Seed,2", "KrankileTyrant,8"]],
+   "iters": 4, "seed": 7}
+
+"agents" is a list of agent mixes, each in sim.py's "Class[,count]" form.
+Every combination is a cell, and each cell is run for iters iterations,
+with the same per-iteration seeds as sim.py --seed would use.
+
+Each iteration's results are cached in DIR under a key made from the
+cell's parameters, the iteration's seed and a hash of the source of the
+simulator (the ENGINE_MODULES) and of the agents it runs (and the classes
+they inherit from).  Re-running a sweep only runs the iterations that
+aren't cached yet, e.g. after adding values to the grid or editing an
+agent or the engine.
+"""
+
+import os
+import sys
+import json
+import inspect
+import hashlib
+import importlib
+import logging
+import itertools
+import multiprocessing
+from optparse import OptionParser
+
+from util import load_modules, make_peer_ids, mean
+from sim import Sim, parse_agents, iteration_seeds, default_config
+
+# The simulator and the helpers agents share; changing any of them can
+# change results, so their source is part of every cache key
+ENGINE_MODULES = ["sim", "vectorsim", "pieces", "ledger", "spread",
+                  "messages", "history", "events", "stats", "peer", "util"]
+
+# The config settings a grid can sweep, besides the agent mix
+SETTINGS = ["num_pieces", "blocks_per_piece", "min_up_bw", "max_up_bw",
+            "max_round"]
+SWEPT = SETTINGS + ["agents"]
+
+# sim.py's defaults, except that the master seed is fixed so that results
+# can be cached
+_defaults = default_config()
+DEFAULTS = dict((name, getattr(_defaults, name)) for name in SETTINGS + ["iters"])
+DEFAULTS["agents"] = _defaults.agent_class_names
+DEFAULTS["seed"] = 0
+
+
+def expand(grid):
+    """The cells of a grid spec: a list of dicts of parameter values."""
+    def values(name):
+        v = grid.get(name, DEFAULTS[name])
+        if name == "agents":
+            # A single mix is a list of strings, several are lists of lists
+            return v if v and isinstance(v[0], list) else [v]
+        return v if isinstance(v, list) else [v]
+
+    return [dict(zip(SWEPT, combo))
+            for combo in itertools.product(*[values(name) for name in SWEPT])]
+
+
+def source_hash(agent_class_names):
+    """Hash of the source of the engine modules, the agents' modules and
+    their base classes'."""
+    classes = load_modules(sorted(set(agent_class_names))).values()
+    files = set(os.path.abspath(inspect.getsourcefile(importlib.import_module(m)))
+                for m in ENGINE_MODULES)
+    for cls in classes:
+        for c in inspect.getmro(cls):
+            f = inspect.getsourcefile(c)
+            if f is not None:
+                files.add(os.path.abspath(f))
+    h = hashlib.sha1()
+    for f in sorted(files):
+        h.update(open(f, "rb").read())
+    return h.hexdigest()
+
+
+def cache_key(cell, seed, agent_hash):
+    spec = json.dumps([cell, seed, agent_hash], sort_keys=True)
+    return hashlib.sha1(spec.encode("utf-8")).hexdigest()
+
+
+def cell_config(cell):
+    config = default_config(parse_agents(cell["agents"]))
+    for name in SETTINGS:
+        config.add(name, cell[name])
+    config.add("quiet", True)
+    return config
+
+
+def _run_job(job):
+    """Pool worker: run one (cell, seed) iteration.  Returns (path, result)."""
+    (path, cell, seed) = job
+    (uploaded, completion, overruns, timer) = Sim(cell_config(cell)).run_iteration(seed)
+    return (path, {"uploaded": uploaded, "completion": completion})
+
+
+def save_result(path, result):
+    """Write a cache file so that it appears whole or not at all."""
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(result, f)
+    os.rename(tmp, path)
+
+
+def summarize(cell, results):
+    """Per agent class means over all its peers and iterations."""
+    names = parse_agents(cell["agents"])
+    class_of = dict(zip(make_peer_ids(names), names))
+    agents = dict()
+    for result in results:
+        for (pid, blocks) in result["uploaded"].items():
+            cls = class_of[pid]
+            a = agents.setdefault(cls, {"uploaded": [], "completion": [],
+                                        "unfinished": 0})
+            a["uploaded"].append(blocks)
+            done = result["completion"][pid]
+            if done is None:
+                a["unfinished"] += 1
+            else:
+                a["completion"].append(done)
+    for a in agents.values():
+        a["uploaded"] = mean(a["uploaded"])
+        a["completion"] = mean(a["completion"]) if a["completion"] else None
+    return {"params": cell, "iterations": len(results), "agents": agents}
+
+
+def run_sweep(grid, cache_dir, workers):
+    """Returns a list of summaries, one per cell."""
+    cells = expand(grid)
+    seeds = iteration_seeds(grid.get("seed", DEFAULTS["seed"]),
+                            grid.get("iters", DEFAULTS["iters"]))
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    hashes = dict()  # agent mix -> source hash
+    paths = dict()   # (cell index, seed) -> cache file
+    for (i, cell) in enumerate(cells):
+        mix = tuple(cell["agents"])
+        if mix not in hashes:
+            hashes[mix] = source_hash(parse_agents(cell["agents"]))
+        for seed in seeds:
+            paths[(i, seed)] = os.path.join(
+                cache_dir, cache_key(cell, seed, hashes[mix]) + ".json")
+
+    missing = [k for k in sorted(paths) if not os.path.exists(paths[k])]
+    logging.warning("%d cells, %d iterations, %d cached, %d to run",
+                    len(cells), len(paths), len(paths) - len(missing),
+                    len(missing))
+
+    # Each result is cached as soon as it arrives, so an interrupted sweep
+    # keeps what it finished
+    jobs = [(paths[(i, seed)], cells[i], seed) for (i, seed) in missing]
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(workers)
+        try:
+            for (path, result) in pool.imap_unordered(_run_job, jobs):
+                save_result(path, result)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        for job in jobs:
+            save_result(*_run_job(job))
+
+    return [summarize(cell, [json.load(open(paths[(i, seed)])) for seed in seeds])
+            for (i, cell) in enumerate(cells)]
+
+
+def main(args):
+    usage_msg = "Usage:  %prog [options] GRID.json"
+    parser = OptionParser(usage=usage_msg)
+
+    parser.add_option("--workers",
+                      dest="workers", default=multiprocessing.cpu_count(),
+                      type="int",
+                      help="Number of worker processes (default: one per CPU)")
+
+    parser.add_option("--cache",
+                      dest="cache", default=".sweep-cache",
+                      help="Directory to cache per-iteration results in")
+
+    parser.add_option("--output",
+                      dest="output", default="-",
+                      help="File to write the JSON summary to (default: stdout)")
+
+    (options, args) = parser.parse_args(args[1:])
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.WARNING, format='%(message)s')
+    grid = json.load(open(args[0]))
+    # Agents may print (Dummy does), so keep stdout for the JSON
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        summaries = run_sweep(grid, options.cache, options.workers)
+    finally:
+        sys.stdout = stdout
+    out = sys.stdout if options.output == "-" else open(options.output, "w")
+    json.dump(summaries, out, indent=2, sort_keys=True)
+    out.write("\n")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
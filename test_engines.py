@@ -0,0 +1,54 @@
+#!/usr/bin/python
+
+"""
+Checks that sim.py's python and vector engines simulate the same agents.
+
+  python -m unittest test_engines
+"""
+
+import unittest
+
+from bench import make_config
+from sim import Sim, parse_agents
+from vectorsim import np
+
+SEEDS = range(6)
+
+
+def mean_completion(engine, agents):
+    """Mean completion round of the non-seed peers over SEEDS."""
+    config = make_config(parse_agents(agents), 16, 8, 300,
+                         min_up_bw=8, max_up_bw=24)
+    config.add("engine", engine)
+    sim = Sim(config)
+    rounds = []
+    for seed in SEEDS:
+        completion = sim.run_iteration(seed)[1]
+        rounds.extend(r for (pid, r) in completion.items()
+                      if not pid.startswith("Seed"))
+    assert None not in rounds, "%s engine didn't finish" % engine
+    return float(sum(rounds)) / len(rounds)
+
+
+@unittest.skipIf(np is None, "the vector engine needs numpy")
+class EnginesAgreeTest(unittest.TestCase):
+    def assertAgree(self, agents):
+        python = mean_completion("python", agents)
+        vector = mean_completion("vector", agents)
+        self.assertAlmostEqual(python, vector, delta=0.15 * python,
+                               msg="%s: python %.1f, vector %.1f rounds" % (
+                                   " ".join(agents), python, vector))
+
+    def test_std(self):
+        self.assertAgree(["Seed,2", "KrankileStd,8"])
+
+    def test_propshare(self):
+        self.assertAgree(["Seed,2", "KrankileStd,4", "KrankilePropshare,4"])
+
+    def test_mixed(self):
+        self.assertAgree(["Seed,2", "KrankileTyrant,3", "KrankileTourney,3",
+                          "Dummy,2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
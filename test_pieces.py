@@ -0,0 +1,85 @@
+#!/usr/bin/python
+
+"""
+Checks that PieceSet behaves like the set agents used to get.
+
+  python -m unittest test_pieces
+"""
+
+import random
+import unittest
+
+from pieces import PieceSet
+
+# Pairs of piece id sets covering empty, equal, subset, disjoint and
+# overlapping cases
+SAMPLES = [set(), set([0]), set([3]), set([0, 3]), set([0, 1, 2, 3]),
+           set([5, 64, 100]), set([1, 64])]
+PAIRS = [(a, b) for a in SAMPLES for b in SAMPLES]
+
+
+class PieceSetTest(unittest.TestCase):
+    def test_binary_operators(self):
+        ops = [lambda x, y: x & y, lambda x, y: x | y,
+               lambda x, y: x - y, lambda x, y: x ^ y]
+        for (a, b) in PAIRS:
+            for op in ops:
+                expected = op(a, b)
+                self.assertEqual(set(op(PieceSet.from_ids(a),
+                                        PieceSet.from_ids(b))), expected)
+                self.assertEqual(set(op(PieceSet.from_ids(a), b)), expected)
+                self.assertEqual(set(op(a, PieceSet.from_ids(b))), expected)
+
+    def test_named_methods(self):
+        for (a, b) in PAIRS:
+            ps = PieceSet.from_ids(a)
+            for other in (b, PieceSet.from_ids(b), list(b)):
+                self.assertEqual(set(ps.intersection(other)), a & b)
+                self.assertEqual(set(ps.union(other)), a | b)
+                self.assertEqual(set(ps.difference(other)), a - b)
+                self.assertEqual(set(ps.symmetric_difference(other)), a ^ b)
+                self.assertEqual(ps.issubset(other), a.issubset(b))
+                self.assertEqual(ps.issuperset(other), a.issuperset(b))
+                self.assertEqual(ps.isdisjoint(other), a.isdisjoint(b))
+
+    def test_comparisons(self):
+        ops = [lambda x, y: x < y, lambda x, y: x <= y,
+               lambda x, y: x > y, lambda x, y: x >= y]
+        for (a, b) in PAIRS:
+            for op in ops:
+                expected = op(a, b)
+                self.assertEqual(op(PieceSet.from_ids(a),
+                                    PieceSet.from_ids(b)), expected)
+                self.assertEqual(op(PieceSet.from_ids(a), b), expected)
+                self.assertEqual(op(PieceSet.from_ids(a), frozenset(b)),
+                                 expected)
+
+    def test_compare_to_non_set(self):
+        ps = PieceSet.from_ids([1, 2])
+        for other in ([1, 2], 3, None):
+            self.assertRaises(TypeError, lambda: ps <= other)
+            self.assertRaises(TypeError, lambda: ps > other)
+
+    def test_container(self):
+        for a in SAMPLES:
+            ps = PieceSet.from_ids(a)
+            self.assertEqual(len(ps), len(a))
+            self.assertEqual(bool(ps), bool(a))
+            self.assertEqual(list(ps), sorted(a))
+            self.assertEqual([ps[i] for i in range(len(a))], sorted(a))
+            self.assertEqual([ps[-i] for i in range(1, len(a) + 1)],
+                             sorted(a)[::-1])
+            self.assertRaises(IndexError, lambda: ps[len(a)])
+            for i in range(-1, 101):
+                self.assertEqual(i in ps, i in a)
+
+    def test_random_choice(self):
+        ps = PieceSet.from_ids([2, 7, 40])
+        rng = random.Random(0)
+        picks = set(rng.choice(ps) for _ in range(100))
+        self.assertEqual(picks, set([2, 7, 40]))
+        self.assertRaises(IndexError, lambda: rng.choice(PieceSet()))
+
+
+if __name__ == "__main__":
+    unittest.main()
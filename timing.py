@@ -0,0 +1,117 @@
+#!/usr/bin/python
+
+"""
+Opt-in timing of the phases of Sim.run_sim_once's round loop.
+
+The sim calls timer.now() before a phase and timer.add(phase, start) after
+it, passing the peer when the phase is one agent's call (its requests() or
+uploads(), or the validation of what it returned).  By default it uses
+NullTimer, whose methods do nothing, so timing costs next to nothing
+unless a PhaseTimer is passed in.
+
+A PhaseTimer keeps every per-agent call's duration, keyed by agent class
+and phase, so that percentiles can be reported, and can optionally keep a
+timeline of every timed call for write_trace() to save in the Chrome trace
+event format (load it in chrome://tracing or Perfetto).
+"""
+
+import json
+import time
+
+PHASES = ["requests", "uploads", "validation", "routing", "piece update",
+          "history"]
+
+
+class PhaseTimer:
+    """Accumulates wall time spent in each phase of the round loop."""
+
+    def __init__(self, trace=False):
+        """trace: also record a timeline of every timed call."""
+        self.totals = dict((phase, 0.0) for phase in PHASES)
+        self.rounds = 0
+        # (agent class name, phase) -> [seconds per call]
+        self.calls = dict()
+        # [(phase, peer id or None, start, seconds)], or None if not tracing
+        self.events = [] if trace else None
+        self.origin = time.time()
+
+    def now(self):
+        return time.time()
+
+    def add(self, phase, start, peer=None):
+        elapsed = time.time() - start
+        self.totals[phase] += elapsed
+        if peer is not None:
+            key = (peer.__class__.__name__, phase)
+            self.calls.setdefault(key, []).append(elapsed)
+        if self.events is not None:
+            self.events.append((phase, peer.id if peer is not None else None,
+                                start, elapsed))
+
+    def end_round(self):
+        self.rounds += 1
+
+    def merge(self, other):
+        """Add other's totals and per-call times (not its timeline) to ours."""
+        for phase in PHASES:
+            self.totals[phase] += other.totals[phase]
+        self.rounds += other.rounds
+        for (key, times) in other.calls.items():
+            self.calls.setdefault(key, []).extend(times)
+
+    def agent_percentiles(self, qs=(50, 90, 99)):
+        """
+        Returns a sorted list of (agent class, phase, calls,
+        [seconds at each percentile in qs], max seconds).
+        """
+        results = []
+        for ((cls, phase), times) in sorted(self.calls.items()):
+            times = sorted(times)
+            results.append((cls, phase, len(times),
+                            [percentile(times, q) for q in qs], times[-1]))
+        return results
+
+
+class NullTimer:
+    """Stands in for a PhaseTimer when timing is off."""
+
+    def now(self):
+        return 0
+
+    def add(self, phase, start, peer=None):
+        pass
+
+    def end_round(self):
+        pass
+
+
+def percentile(sorted_values, q):
+    """The nearest-rank q-th percentile of a non-empty sorted list."""
+    rank = int(round(q / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[rank]
+
+
+def write_trace(path, timers):
+    """
+    Save the timelines of a list of tracing PhaseTimers, one per
+    iteration, as a Chrome trace.  Each iteration is a process and each
+    peer a thread; phases that aren't one agent's call go on a "sim" thread.
+    """
+    events = []
+    for (pid, timer) in enumerate(timers):
+        tids = {None: 0}
+        events.append({"name": "process_name", "ph": "M", "pid": pid,
+                       "args": {"name": "iteration %d" % pid}})
+        events.append({"name": "thread_name", "ph": "M", "pid": pid,
+                       "tid": 0, "args": {"name": "sim"}})
+        for (phase, peer_id, start, elapsed) in timer.events:
+            if peer_id not in tids:
+                tids[peer_id] = len(tids)
+                events.append({"name": "thread_name", "ph": "M", "pid": pid,
+                               "tid": tids[peer_id], "args": {"name": peer_id}})
+            events.append({"name": phase, "ph": "X", "pid": pid,
+                           "tid": tids[peer_id],
+                           "ts": (start - timer.origin) * 1e6,
+                           "dur": elapsed * 1e6})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
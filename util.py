@@ -97,6 +97,36 @@ def load_modules(agent_classes):
         return (class_name, agent_class)
 
     return dict(map(load, agent_classes))
+
+
+def sample_neighborhoods(rng, n, k):
+    """
+    Tracker-style neighborhoods for n peers: each peer is handed k others
+    at random, and connections go both ways, so every peer ends up with at
+    least k neighbors (about 2k on average).
+
+    Returns a list, for each peer index, of its neighbors' indices in order.
+    """
+    k = min(k, n - 1)
+    sets = [set() for i in range(n)]
+    for i in range(n):
+        for j in rng.sample(xrange(n - 1), k):
+            if j >= i:
+                j += 1  # skip ourselves
+            sets[i].add(j)
+            sets[j].add(i)
+    return [sorted(s) for s in sets]
+
+
+def make_peer_ids(agent_class_names):
+    """Number the agents of each class in order: Dummy0, Dummy1, Seed0..."""
+    counts = dict()
+    def index(name):
+        a = counts.get(name, 0)
+        counts[name] = a + 1
+        return a
+
+    return map(lambda n: "%s%d" % (n, index(n)), agent_class_names)
     
 
 
@@ -0,0 +1,306 @@
+#!/usr/bin/python
+
+"""
+A vectorized round engine for large parameter sweeps (sim.py --engine vector).
+
+All of the swarm state lives in NumPy arrays:
+  - blocks:  peers x pieces block counts
+  - have:    peers x pieces bitmap of completed pieces
+  - inbox:   uploaders x requesters bitmap of who asked whom this round
+  - uploads: parallel (from, to, bw) arrays, one entry per unchoke
+
+and piece updates, availability and the done checks are batched array
+operations.  Seed has a built-in vectorized equivalent; every other agent
+class runs its normal Python requests() and uploads() through PythonAgent,
+which translates to and from the arrays, so it behaves as it does under
+the Python engine.
+
+The inbox is a dense peers x peers bitmap (about 100MB for 10,000 peers).
+"""
+
+import random
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from messages import Upload, Request, Download, PeerInfo, AllBut
+from history import AgentHistory
+from pieces import PieceSet, RarityIndex, RarityView
+from util import IllegalUpload, IllegalRequest, make_peer_ids
+
+SEED, PYTHON = range(2)
+
+BUILTIN_KINDS = {
+    "Seed": SEED,
+}
+
+# Rows of the inbox matrix handled at a time when computing it and when
+# picking random requesters, to bound temporary memory on huge swarms.
+CHUNK = 1024
+
+
+def pick_random(mask, rng, tries=8):
+    """
+    mask: rows x cols bool array.
+    Returns, for each row, the column index of one of its True entries
+    chosen uniformly at random, or -1 if the row has none.
+
+    Inboxes are usually dense, so a few rounds of rejection sampling settle
+    most rows; only the rest pay for a full scan.
+    """
+    picks = -np.ones(len(mask), dtype=np.int64)
+    todo = np.flatnonzero(mask.any(axis=1))
+    for t in range(tries):
+        if len(todo) == 0:
+            return picks
+        cand = rng.randint(0, mask.shape[1], len(todo))
+        hit = mask[todo, cand]
+        picks[todo[hit]] = cand[hit]
+        todo = todo[~hit]
+    for lo in range(0, len(todo), CHUNK):
+        rows = todo[lo:lo + CHUNK]
+        chunk = mask[rows]
+        k = np.floor(rng.random_sample(len(rows)) * chunk.sum(axis=1))
+        picks[rows] = (chunk.cumsum(axis=1) > k[:, None]).argmax(axis=1)
+    return picks
+
+
+def even_split_at(n, k, t):
+    """Element-wise util.even_split: the t-th share of n split into k."""
+    return n // k + (t >= k - n % k)
+
+
+class PythonAgent:
+    """
+    Adapter that runs an ordinary Python agent inside the vector engine.
+    Builds the PeerInfo, Request and AgentHistory objects the agent
+    expects, and validates what it returns like sim.py does.
+    """
+
+    def __init__(self, sim, index, peer):
+        self.sim = sim
+        self.index = index
+        self.peer = peer
+        self.downloads = []  # [[Download objects for round]]
+        self.uploads = []    # [[Upload objects for round]]
+        self.view = AgentHistory(peer.id, self.downloads, self.uploads)
+
+    def history(self):
+        return self.view
+
+    def peer_info(self):
+        return AllBut(self.sim.peer_infos, self.index)
+
+    def requests(self):
+        s = self.sim
+        p = self.peer
+        p.update_pieces(s.blocks[self.index].tolist())
+        p.update_rarity(s.rarity_view)
+        rs = p.requests(self.peer_info(), self.history())
+        for r in rs:
+            if (not isinstance(r, Request) or r.requester_id != p.id or
+                    r.peer_id not in s.index_of or
+                    r.piece_id < 0 or r.piece_id >= s.m or
+                    r.start < 0 or r.start >= s.bpp or
+                    r.start > s.blocks[self.index, r.piece_id] or
+                    not s.have[s.index_of[r.peer_id], r.piece_id]):
+                raise IllegalRequest("Bad request from %s: %s" % (p.id, r))
+        return rs
+
+    def uploads_for(self, requests):
+        s = self.sim
+        p = self.peer
+        us = p.uploads(requests, self.peer_info(), self.history())
+        for u in us:
+            if (not isinstance(u, Upload) or u.from_id != p.id or
+                    u.to_id == p.id or u.to_id not in s.index_of or u.bw < 0):
+                raise IllegalUpload("Bad upload from %s: %s" % (p.id, u))
+        if sum(u.bw for u in us) > s.up_bw[self.index]:
+            raise IllegalUpload("Can't upload more than limit of %d. %s" % (
+                s.up_bw[self.index], us))
+        return us
+
+
+class VectorSim:
+    def __init__(self, config, seed):
+        if np is None:
+            raise ImportError("--engine vector needs numpy")
+        c = config
+        self.config = config
+        self.rng = np.random.RandomState(seed)
+        self.ids = make_peer_ids(c.agent_class_names)
+        self.index_of = dict((pid, i) for (i, pid) in enumerate(self.ids))
+        self.n = n = len(self.ids)
+        self.m = m = c.num_pieces
+        self.bpp = c.blocks_per_piece
+
+        self.kind = np.array([BUILTIN_KINDS.get(name, PYTHON)
+                              for name in c.agent_class_names])
+        is_seed = np.array([pid.startswith("Seed") for pid in self.ids])
+        self.up_bw = np.where(is_seed, c.max_up_bw,
+                              self.rng.randint(c.min_up_bw, c.max_up_bw + 1, n))
+
+        self.seed_slots = 4
+
+        # Floats, since Python agents may upload fractional bandwidth
+        self.blocks = np.zeros((n, m))
+        self.blocks[is_seed] = self.bpp
+        self.have = self.blocks >= self.bpp
+
+        self.done_round = -np.ones(n, dtype=np.int64)
+        self.uploaded = np.zeros(n)
+
+        self.agents = dict()  # index -> PythonAgent
+        streams = random.Random(seed)  # per-agent random.Random seeds
+        for i in np.flatnonzero(self.kind == PYTHON):
+            agent_class = c.agent_classes[c.agent_class_names[i]]
+            pieces = self.blocks[i].tolist()
+            peer = agent_class(c, self.ids[i], pieces, int(self.up_bw[i]),
+                               random.Random(streams.getrandbits(64)))
+            self.agents[i] = PythonAgent(self, i, peer)
+
+    def rarity(self):
+        """Number of peers that have each piece."""
+        return self.have.sum(axis=0)
+
+    def compute_inbox(self, python_requests):
+        """inbox[j, i] is True if peer i asked peer j for something this round."""
+        inbox = np.zeros((self.n, self.n), dtype=bool)
+        for (i, rs) in python_requests.items():
+            for r in rs:
+                inbox[self.index_of[r.peer_id], i] = True
+        np.fill_diagonal(inbox, False)
+        return inbox
+
+    def python_inbox(self, j, python_requests):
+        """Request objects addressed to the Python agent j."""
+        ans = []
+        for rs in python_requests.values():
+            ans.extend(r for r in rs if r.peer_id == self.ids[j])
+        return ans
+
+    def seed_uploads(self, uploaders, inbox):
+        """Seed: split bandwidth evenly among up to 4 random requesters."""
+        mask = inbox[uploaders].copy()
+        n_chosen = np.minimum(mask.sum(axis=1), self.seed_slots)
+        frm, to, bw = [], [], []
+        for t in range(self.seed_slots):
+            picks = pick_random(mask, self.rng)
+            ok = picks >= 0
+            rows = np.flatnonzero(ok)
+            mask[rows, picks[ok]] = False
+            frm.append(uploaders[ok])
+            to.append(picks[ok])
+            bw.append(even_split_at(self.up_bw[uploaders[ok]], n_chosen[ok], t))
+        return (np.concatenate(frm), np.concatenate(to), np.concatenate(bw))
+
+    def python_uploads(self, inbox, python_requests):
+        frm, to, bw = [], [], []
+        for (j, agent) in sorted(self.agents.items()):
+            us = agent.uploads_for(self.python_inbox(j, python_requests))
+            agent.uploads.append(us)
+            for u in us:
+                frm.append(j)
+                to.append(self.index_of[u.to_id])
+                bw.append(u.bw)
+        return (np.array(frm, dtype=np.int64), np.array(to, dtype=np.int64),
+                np.array(bw, dtype=np.float64))
+
+    def round_uploads(self, inbox, python_requests):
+        """All of this round's unchokes as (from, to, bw) arrays."""
+        parts = [self.seed_uploads(np.flatnonzero(self.kind == SEED), inbox),
+                 self.python_uploads(inbox, python_requests)]
+        frm = np.concatenate([p[0] for p in parts]).astype(np.int64)
+        to = np.concatenate([p[1] for p in parts]).astype(np.int64)
+        bw = np.concatenate([p[2] for p in parts]).astype(np.float64)
+        return (frm, to, bw)
+
+    def transfer(self, frm, to, bw, python_requests):
+        """
+        Apply one round of uploads, the batched version of sim.py's
+        update_peer_pieces: each edge's bandwidth goes, in order, to the
+        pieces its requester asked the uploader for, and a requester only
+        keeps the biggest contribution to each piece.
+        Returns the credited downloads as (from, to, piece, blocks) arrays.
+        """
+        (n, m, bpp) = (self.n, self.m, self.bpp)
+        keep = bw > 0
+        (frm, to, bw) = (frm[keep], to[keep], bw[keep])
+
+        # The requesters' requests, in the order they made them
+        edge, piece, start = [], [], []
+        for e in np.flatnonzero(self.kind[to] == PYTHON):
+            uploader_id = self.ids[frm[e]]
+            for r in python_requests[to[e]]:
+                if r.peer_id == uploader_id:
+                    edge.append(e)
+                    piece.append(r.piece_id)
+                    start.append(r.start)
+        edge = np.array(edge, dtype=np.int64)
+        piece = np.array(piece, dtype=np.int64)
+        start = np.array(start, dtype=np.float64)
+
+        # This bandwidth gets applied in order to each piece requested
+        needed = bpp - start
+        before = np.cumsum(needed) - needed
+        before -= before[np.searchsorted(edge, edge)]
+        alloc = np.clip(bw[edge] - before, 0, needed)
+
+        key = to[edge] * m + piece
+        best = np.zeros(n * m)
+        np.maximum.at(best, key, alloc)
+        credited = np.flatnonzero((alloc > 0) & (alloc == best[key]))
+        (_, first) = np.unique(key[credited], return_index=True)
+        credited = credited[first]
+
+        self.blocks += best.reshape(n, m)
+        self.have = self.blocks >= bpp
+        e = edge[credited]
+        return (frm[e], to[e], piece[credited], alloc[credited])
+
+    def record(self, downloads):
+        (frm, to, piece, blocks) = downloads
+        self.uploaded += np.bincount(frm, weights=blocks, minlength=self.n)
+        for (i, agent) in self.agents.items():
+            agent.downloads.append([
+                Download(self.ids[f], self.ids[i], int(p), b)
+                for (f, p, b) in zip(frm[to == i], piece[to == i].tolist(),
+                                     blocks[to == i].tolist())])
+
+    def run(self):
+        """
+        Run one simulation.  Returns (uploaded blocks, completion rounds),
+        dicts keyed by peer id, like Sim.run_iteration.
+        """
+        conf = self.config
+        round = 0
+        while True:
+            if self.agents:
+                # This round's PeerInfo and rarity, shared by every Python agent
+                self.peer_infos = tuple(
+                    PeerInfo(pid, PieceSet.from_ids(np.flatnonzero(have).tolist()))
+                    for (pid, have) in zip(self.ids, self.have))
+                self.rarity_view = RarityView(RarityIndex(self.rarity().tolist()))
+            python_requests = dict((i, agent.requests())
+                                   for (i, agent) in self.agents.items())
+            inbox = self.compute_inbox(python_requests)
+            (frm, to, bw) = self.round_uploads(inbox, python_requests)
+            self.record(self.transfer(frm, to, bw, python_requests))
+
+            done = self.have.all(axis=1)
+            self.done_round[done & (self.done_round < 0)] = round
+            if done.all():
+                logging.info("All done!")
+                break
+            round += 1
+            if round > conf.max_round:
+                logging.info("Out of time.  Stopping.")
+                break
+
+        uploaded = dict(zip(self.ids, self.uploaded.tolist()))
+        completion = dict((pid, r if r >= 0 else None)
+                          for (pid, r) in zip(self.ids, self.done_round.tolist()))
+        return (uploaded, completion)